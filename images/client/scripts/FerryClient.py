@@ -3,47 +3,290 @@ FerryClient
 
 Module to connect to FERRY
 """
+import codecs
+import json
 import logging
 import os
+import threading
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError
+from urllib3.util.retry import Retry
 
 
 class UserLDAPError(Exception):
     pass
 
 
+class JSONStream:
+    """
+    Incremental reader of a JSON document arriving in chunks
+
+    Yields the items of one array nested in the document, e.g. the
+    ferry_output list, while only buffering the item being decoded.
+    Everything outside the path to that array is decoded and discarded.
+    """
+    WHITESPACE = ' \t\n\r'
+    DELIMITERS = WHITESPACE + ',:]}'
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        """
+        Appends the next chunk to the buffer, returns False at the end of the body
+        """
+        if self._eof:
+            return False
+        # drop what was consumed already
+        self._buf = self._buf[self._pos:]
+        self._pos = 0
+        for chunk in self._chunks:
+            text = self._decoder.decode(chunk)
+            if text:
+                self._buf += text
+                return True
+        self._buf += self._decoder.decode(b'', final=True)
+        self._eof = True
+        return False
+
+    def _peek(self) -> str:
+        """
+        Returns the next non-whitespace character without consuming it
+        """
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in self.WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON document")
+
+    def _expect(self, chars: str) -> str:
+        char = self._peek()
+        if char not in chars:
+            raise ValueError(f"Expected one of {chars!r} in JSON document, got {char!r}")
+        self._pos += 1
+        return char
+
+    def _value(self):
+        """
+        Decodes the next value, reading more of the body until it is complete
+        """
+        self._peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buf, self._pos)
+                # a number cut by the end of a chunk may continue in the next one
+                if self._eof or (end < len(self._buf) and self._buf[end] in self.DELIMITERS):
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill()
+
+    def _members(self):
+        """
+        Iterates over the keys of an object, the caller consumes each value
+        """
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            yield key
+            if self._expect(',}') == '}':
+                return
+
+    def _elements(self):
+        """
+        Iterates over the indexes of an array, the caller consumes each element
+        """
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        index = 0
+        while True:
+            yield index
+            index += 1
+            if self._expect(',]') == ']':
+                return
+
+    def items(self, path: tuple):
+        """
+        Yields the items of the array at path, a tuple of object keys and array indexes
+
+        Raises KeyError if the document has no such array
+        """
+        if not path:
+            if self._peek() != '[':
+                raise KeyError("Expected an array in the JSON document")
+            for _ in self._elements():
+                yield self._value()
+            return
+        head, rest = path[0], path[1:]
+        found = False
+        positions = self._members() if isinstance(head, str) else self._elements()
+        for position in positions:
+            if position == head and not found:
+                found = True
+                yield from self.items(rest)
+            else:
+                self._value()
+        if not found:
+            raise KeyError(head)
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter spacing calls evenly to at most max_rate per second
+
+    A max_rate of 0 or less disables the limit
+    """
+    def __init__(self, max_rate: float = 0):
+        self.interval = 1.0 / max_rate if max_rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        Blocks until the next call is allowed
+        """
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
 class FerryClient:
     """
     Client to access FERRY
+
+    Requests go through a pooled session that keeps the mutual TLS
+    connections to FERRY alive between calls. Use it as a context manager,
+    or call close(), to release the connections.
     """
-    def __init__(self, logger=None):
+    def __init__(self, logger=None, max_rate: float = None, pool_size: int = None,
+                 retries: int = None, backoff_factor: float = None, timeout: float = None):
         self.logger = logger or logging.getLogger()
+        if max_rate is None:
+            max_rate = float(os.getenv("FERRY_MAX_RATE", "20"))
+        if pool_size is None:
+            pool_size = int(os.getenv("FERRY_POOL_SIZE", "10"))
+        if retries is None:
+            retries = int(os.getenv("FERRY_RETRIES", "3"))
+        if backoff_factor is None:
+            backoff_factor = float(os.getenv("FERRY_BACKOFF_FACTOR", "0.5"))
+        if timeout is None:
+            timeout = float(os.getenv("FERRY_TIMEOUT", "60"))
+        self.limiter = RateLimiter(max_rate)
+        self.timeout = timeout
         self.server = os.getenv("FERRY_URL", "https://ferry.fnal.gov:8445")
-        self.capath = os.getenv("CA_PATH" "/etc/grid-security/certificates")
+        self.capath = os.getenv("CA_PATH", "/etc/grid-security/certificates")
         self.cert = os.getenv("X509_USER_CERT", "/opt/rucio/certs/usercert.pem")
         self.key = os.getenv("X509_USER_KEY", "/opt/rucio/keys/userkey.pem")
 
+        # retry idempotent GETs on connection errors and 5xx responses
+        retry = Retry(total=retries,
+                      backoff_factor=backoff_factor,
+                      status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=frozenset(["GET"]),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size), max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.cert = (self.cert, self.key)
+        self.session.verify = self.capath
+
+        # endpoint -> [calls, total seconds, max seconds]
+        self.timings = {}
+        self._timings_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Closes the pooled connections to FERRY
+        """
+        self.session.close()
+
     def get(self, url: str, params: dict = None) -> dict:
         """
         Get method for FERRY
 
-        Adds SSL for request
+        Adds SSL for request, calls are throttled to max_rate per second
         """
+        self.limiter.wait()
+        start = time.monotonic()
         try:
-            r = requests.get(url,
-                params=params,
-                cert=(self.cert, self.key),
-                verify=self.capath)
+            r = self.session.get(url, params=params, timeout=self.timeout)
             r.raise_for_status()
         except HTTPError as e:
             self.logger.error(e)
             raise
+        finally:
+            self._record(url.rsplit("/", 1)[-1], time.monotonic() - start)
 
         data = r.json()
         return data["ferry_output"]
-    
+
+    def stream(self, url: str, params: dict = None, path: tuple = ("ferry_output",), chunk_size: int = 65536):
+        """
+        Streaming get method for FERRY
+
+        Yields the records of the array at path while the response body
+        arrives, instead of materializing the whole document
+        """
+        self.limiter.wait()
+        start = time.monotonic()
+        try:
+            with self.session.get(url, params=params, timeout=self.timeout, stream=True) as r:
+                try:
+                    r.raise_for_status()
+                except HTTPError as e:
+                    self.logger.error(e)
+                    raise
+                yield from JSONStream(r.iter_content(chunk_size)).items(path)
+        finally:
+            self._record(url.rsplit("/", 1)[-1], time.monotonic() - start)
+
+    def _record(self, endpoint: str, elapsed: float):
+        with self._timings_lock:
+            timing = self.timings.setdefault(endpoint, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += elapsed
+            timing[2] = max(timing[2], elapsed)
+
+    def log_timings(self):
+        """
+        Logs the number of calls and the time spent per FERRY endpoint
+        """
+        with self._timings_lock:
+            timings = sorted(self.timings.items())
+        for endpoint, (calls, total, slowest) in timings:
+            self.logger.info(f"FERRY {endpoint}: {calls} calls, {total:.2f}s total, "
+                             f"{total / calls * 1000:.1f}ms mean, {slowest * 1000:.1f}ms max")
+
     def getGroupMembers(self, groupname: str) -> dict:
         """
         Returns all the members of the specified group
@@ -72,6 +315,14 @@ class FerryClient:
         r = self.get(url, params)
         return r
 
+    def iterAffiliationMembers(self, unitname: str):
+        """
+        Streams the members of an affiliation, yielding one user record at a time
+        """
+        url = f"{self.server}/getAffiliationMembers"
+        params = {"unitname": unitname}
+        return self.stream(url, params, path=("ferry_output", 0, "users"))
+
     def getAffiliationUnitMembers(self, unitname: str) -> dict:
         """
         Fetches members of an affiliation a given unitname from SNOW
@@ -101,6 +352,16 @@ class FerryClient:
         r = self.get(url, params)
         return r
 
+    def iterAllUsersCertificateDNs(self, unitname: str = None):
+        """
+        Streams all user's DNs, yielding one user record at a time
+        """
+        url = f"{self.server}/getAllUsersCertificateDNs"
+        params = {}
+        if unitname:
+            params['unitname'] = unitname
+        return self.stream(url, params)
+
     def getUserLdapInfo(self, username: str) -> dict:
         """
         Fetches user's LDAP information
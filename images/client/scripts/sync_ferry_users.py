@@ -9,15 +9,23 @@ The DN of the cert used to access FERRY needs Read-only access
 """
 
 import argparse
-from dataclasses import dataclass, asdict
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict, field
+import hashlib
+import json
 import logging
 import os
+import socket
+import sqlite3
 import sys
+import threading
+import time
 
 from rucio.client import Client as RucioClient
 from rucio.common.exception import AccountNotFound, Duplicate
 
-from FerryClient import FerryClient, UserLDAPError
+from FerryClient import FerryClient, RateLimiter, UserLDAPError
 
 # setup logger
 logger = logging.getLogger()
@@ -35,6 +43,32 @@ ANALYSIS_ATTRIBUTES = [
     "update_replicas_states"
 ]
 
+# number of concurrent FERRY requests when fetching user info
+FERRY_WORKERS = int(os.getenv("FERRY_WORKERS", "8"))
+
+# number of accounts committed concurrently, and the ceiling of Rucio requests per second
+RUCIO_WORKERS = int(os.getenv("RUCIO_WORKERS", "4"))
+RUCIO_MAX_RATE = float(os.getenv("RUCIO_MAX_RATE", "20"))
+
+# snapshot of the users synced by the last committed run, used by --delta
+STATE_FILE = os.getenv("FERRY_STATE_FILE", "/var/lib/ferry-sync/state.json")
+
+# journal of the progress of committing runs, used by --resume
+JOURNAL_FILE = os.getenv("FERRY_JOURNAL_FILE", "/var/lib/ferry-sync/journal.jsonl")
+# plans older than this many seconds, or resumed this many times, are dropped for a new run
+JOURNAL_MAX_AGE = int(os.getenv("FERRY_JOURNAL_MAX_AGE", str(86400)))
+JOURNAL_MAX_RESUMES = int(os.getenv("FERRY_JOURNAL_MAX_RESUMES", "3"))
+
+# persistent cache of LDAP emails, entries for users without an email expire sooner
+EMAIL_CACHE = os.getenv("FERRY_EMAIL_CACHE", "/var/lib/ferry-sync/emails.sqlite3")
+EMAIL_TTL = int(os.getenv("FERRY_EMAIL_TTL", str(30 * 86400)))
+EMAIL_NEGATIVE_TTL = int(os.getenv("FERRY_EMAIL_NEGATIVE_TTL", "86400"))
+
+# metrics of the run, sent to a statsd host:port and/or written to a Prometheus textfile
+STATSD = os.getenv("FERRY_STATSD", "")
+STATSD_PREFIX = os.getenv("FERRY_STATSD_PREFIX", "ferry_sync")
+METRICS_FILE = os.getenv("FERRY_METRICS_FILE", "")
+
 
 @dataclass
 class User:
@@ -47,125 +81,675 @@ class User:
     identities: list[str]
     uuid: str
     issuer: str
+    active: bool = True
+
+    def digest(self) -> str:
+        """
+        Content hash of the FERRY state of the user
+        """
+        content = json.dumps([self.active, self.uuid, self.issuer, sorted(d['dn'] for d in self.identities)])
+        return hashlib.sha256(content.encode()).hexdigest()[:16]
+
+
+@dataclass
+class AccountDiff:
+    """
+    Reconciliation of the Rucio USER accounts with the FERRY affiliation
+    """
+    add: list[str] = field(default_factory=list)
+    disable: dict[str, str] = field(default_factory=dict)
+    keep: list[str] = field(default_factory=list)
+
+
+class Journal:
+    """
+    Durable record of a committing run, so an interrupted run can be resumed
+
+    The first line holds the plan of the run and when it started, every
+    following line records one account that was synced, failed or disabled,
+    or a resume of the run. Plans older than max_age seconds, or already
+    resumed max_resumes times, are dropped, so a run that keeps failing does
+    not replay a stale FERRY plan forever.
+    """
+    def __init__(self, path: str, max_age=JOURNAL_MAX_AGE, max_resumes=JOURNAL_MAX_RESUMES):
+        self.path = path
+        self.max_age = max_age
+        self.max_resumes = max_resumes
+        self._file = None
+        self._lock = threading.Lock()
+
+    def load(self) -> tuple[dict, dict[str, str]]:
+        """
+        Returns the plan of the interrupted run, or None if there is none or it
+        was dropped, and the events recorded per account
+        """
+        plan = None
+        started = 0.0
+        resumes = 0
+        progress = {}
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the last line may be cut short by the interruption
+                        continue
+                    if 'plan' in entry:
+                        plan = entry['plan']
+                        started = entry.get('started', 0.0)
+                    elif 'resumed' in entry:
+                        resumes += 1
+                    else:
+                        progress[entry['account']] = entry['event']
+        except FileNotFoundError:
+            pass
+        if plan is not None:
+            age = time.time() - started
+            if age > self.max_age or resumes >= self.max_resumes:
+                logger.error(f"Dropping the plan of the interrupted run, started {age:.0f}s ago "
+                             f"and resumed {resumes} times, starting a new one")
+                return None, {}
+        return plan, progress
+
+    def start(self, plan: dict):
+        """
+        Replaces the journal with the plan of a new run
+        """
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(json.dumps({'plan': plan, 'started': time.time()}, separators=(',', ':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._file = open(self.path, 'a')
+
+    def record(self, account: str, event: str):
+        """
+        Durably records that an account was synced, failed or disabled
+        """
+        self._append({'account': account, 'event': event})
+
+    def resumed(self):
+        """
+        Durably records that the plan is being resumed
+        """
+        self._append({'resumed': time.time()})
+
+    def _append(self, entry: dict):
+        if self._file is None:
+            self._file = open(self.path, 'a')
+        with self._lock:
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def finish(self):
+        """
+        Removes the journal of a run that completed
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class EmailCache:
+    """
+    SQLite backed cache of the LDAP email of users
+
+    Users without an LDAP email are cached as None with a shorter TTL
+    """
+    def __init__(self, path: str, ttl=EMAIL_TTL, negative_ttl=EMAIL_NEGATIVE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS emails (username TEXT PRIMARY KEY, email TEXT, expires REAL)")
+            self._db.execute("DELETE FROM emails WHERE expires < ?", (time.time(),))
+
+    def get(self, username: str) -> tuple[bool, str]:
+        """
+        Returns whether the user is cached and its email, None if it has none
+        """
+        with self._lock:
+            row = self._db.execute("SELECT email FROM emails WHERE username = ? AND expires >= ?",
+                                   (username, time.time())).fetchone()
+            if row is None:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            return True, row[0]
+
+    def set(self, username: str, email: str):
+        """
+        Caches the email of a user, None if it has none
+        """
+        expires = time.time() + (self.ttl if email else self.negative_ttl)
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO emails VALUES (?, ?, ?)", (username, email, expires))
+
+    def close(self):
+        logger.info(f"Email cache: {self.hits} hits, {self.misses} misses")
+        self._db.close()
+
+
+def open_email_cache(path: str) -> EmailCache:
+    """
+    Opens the email cache, or returns None if it is disabled or unusable
+    """
+    if not path:
+        return None
+    try:
+        return EmailCache(path)
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Could not open email cache {path}, fetching all emails from FERRY")
+        logger.error(e)
+        return None
+
+
+class SyncMetrics:
+    """
+    Durations, request counts and user outcomes of a sync run
+
+    Requests are kept per service and endpoint as [calls, total seconds, max seconds],
+    like the FerryClient timings. Every user outcome is reported, 0 when it did not
+    occur, so gauges of a previous run do not linger.
+    """
+    OUTCOMES = ('added', 'updated', 'unchanged', 'skipped', 'failed', 'disabled')
+
+    def __init__(self, vo: str):
+        self.vo = vo
+        self.start = time.monotonic()
+        self.duration = 0.0
+        self.success = False
+        self.phases = {}
+        self.users = Counter(dict.fromkeys(self.OUTCOMES, 0))
+        self.requests = {'ferry': {}, 'rucio': {}}
+        self._lock = threading.Lock()
+
+    def phase(self, name: str, seconds: float):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def count(self, outcome: str, n: int = 1):
+        with self._lock:
+            self.users[outcome] += n
+
+    def request(self, service: str, endpoint: str, seconds: float):
+        with self._lock:
+            timing = self.requests[service].setdefault(endpoint, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    def finish(self, success: bool, ferry_timings: dict[str, list]):
+        """
+        Closes the run, taking the request timings of the FERRY client
+        """
+        self.duration = time.monotonic() - self.start
+        self.success = success
+        self.requests['ferry'] = {endpoint: list(timing) for endpoint, timing in ferry_timings.items()}
+
+    def statsd_lines(self, prefix: str = STATSD_PREFIX) -> list[str]:
+        """
+        Durations as timers, everything else as gauges of the last run
+        """
+        prefix = f"{prefix}.{self.vo}"
+        lines = [f"{prefix}.duration:{self.duration * 1000:.0f}|ms",
+                 f"{prefix}.success:{int(self.success)}|g"]
+        lines += [f"{prefix}.phase.{name}:{seconds * 1000:.0f}|ms" for name, seconds in self.phases.items()]
+        lines += [f"{prefix}.users.{outcome}:{n}|g" for outcome, n in sorted(self.users.items())]
+        for service, endpoints in self.requests.items():
+            for endpoint, (calls, total, slowest) in sorted(endpoints.items()):
+                lines += [f"{prefix}.{service}.{endpoint}.requests:{calls}|g",
+                          f"{prefix}.{service}.{endpoint}.latency_mean:{total / calls * 1000:.1f}|g",
+                          f"{prefix}.{service}.{endpoint}.latency_max:{slowest * 1000:.1f}|g"]
+        return lines
+
+    def send_statsd(self, address: str, prefix: str = STATSD_PREFIX):
+        """
+        Sends the metrics to statsd at host:port over UDP, several lines per datagram
+        """
+        host, _, port = address.rpartition(':')
+        packets, packet = [], ""
+        for line in self.statsd_lines(prefix):
+            if packet and len(packet) + len(line) >= 1400:
+                packets.append(packet)
+                packet = ""
+            packet = f"{packet}\n{line}" if packet else line
+        packets.append(packet)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for packet in packets:
+                sock.sendto(packet.encode(), (host, int(port)))
+
+    def prometheus(self) -> str:
+        """
+        Renders the metrics in the Prometheus text exposition format
+        """
+        vo = f'vo="{self.vo}"'
+        metrics = [
+            ('ferry_sync_duration_seconds', 'Duration of the last sync run', [(vo, self.duration)]),
+            ('ferry_sync_success', 'Whether the last sync run finished without error', [(vo, int(self.success))]),
+            ('ferry_sync_last_run_timestamp_seconds', 'End time of the last sync run', [(vo, time.time())]),
+            ('ferry_sync_phase_duration_seconds', 'Duration of the phases of the last sync run',
+             [(f'{vo},phase="{name}"', seconds) for name, seconds in self.phases.items()]),
+            ('ferry_sync_users', 'Users of the last sync run by outcome',
+             [(f'{vo},outcome="{outcome}"', n) for outcome, n in sorted(self.users.items())]),
+        ]
+        requests = [(f'{vo},service="{service}",endpoint="{endpoint}"', timing)
+                    for service, endpoints in self.requests.items() for endpoint, timing in sorted(endpoints.items())]
+        metrics += [
+            ('ferry_sync_requests', 'FERRY and Rucio requests of the last sync run',
+             [(labels, calls) for labels, (calls, _, _) in requests]),
+            ('ferry_sync_request_duration_seconds_total', 'Time spent in FERRY and Rucio requests of the last sync run',
+             [(labels, total) for labels, (_, total, _) in requests]),
+            ('ferry_sync_request_duration_seconds_max', 'Slowest FERRY and Rucio request of the last sync run',
+             [(labels, slowest) for labels, (_, _, slowest) in requests]),
+        ]
+        lines = []
+        for name, help, samples in metrics:
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+            lines += [f"{name}{{{labels}}} {value}" for labels, value in samples]
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        """
+        Writes the metrics for the node exporter textfile collector, replacing the file atomically
+        """
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(tmp, path)
+
+
+def report_metrics(metrics: SyncMetrics, statsd: str, metrics_file: str):
+    """
+    Sends and writes the metrics of the run, errors are only logged
+    """
+    if statsd:
+        try:
+            metrics.send_statsd(statsd)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not send metrics to statsd at {statsd}")
+            logger.error(e)
+    if metrics_file:
+        try:
+            metrics.write_textfile(metrics_file)
+        except OSError as e:
+            logger.error(f"Could not write metrics to {metrics_file}")
+            logger.error(e)
 
 
 def sync_ferry_users(commit=False,
                      delete_accounts=False,
                      scopes=False,
                      analysis=False,
-                     vo='int'):
+                     vo='int',
+                     workers=FERRY_WORKERS,
+                     max_rate=None,
+                     delta=False,
+                     state_file=STATE_FILE,
+                     email_cache=EMAIL_CACHE,
+                     commit_workers=RUCIO_WORKERS,
+                     rucio_max_rate=RUCIO_MAX_RATE,
+                     journal_file=JOURNAL_FILE,
+                     resume=False,
+                     statsd=STATSD,
+                     metrics_file=METRICS_FILE):
     """
     Fetches users from FERRY and adds them to Rucio with analysis attributes
     """
-    # setup clients
-    ferry = FerryClient(logger=logger)
+    # setup clients, keep one pooled FERRY connection per worker
+    ferry = FerryClient(logger=logger, max_rate=max_rate, pool_size=workers)
     client = RucioClient()
-
+    emails = open_email_cache(email_cache) if commit else None
+    journal = Journal(journal_file) if commit else None
     unitname = os.getenv("FERRY_VO", vo)
+    metrics = SyncMetrics(unitname)
+    success = False
+
+    try:
+        options = {'vo': unitname, 'scopes': scopes, 'analysis': analysis}
+
+        # continue the plan of an interrupted run, or make a new one
+        plan, progress = journal.load() if resume and journal else (None, {})
+        if plan is not None:
+            if plan['options'] != options or plan['delta'] != delta or plan['delete_accounts'] != delete_accounts:
+                logger.info("Resuming with the options of the interrupted run")
+            options, delta, delete_accounts = plan['options'], plan['delta'], plan['delete_accounts']
+            scopes, analysis = options['scopes'], options['analysis']
+            journal.resumed()
+        elif resume:
+            logger.info("No interrupted run to resume, starting a new one")
+
+        snapshot = load_snapshot(state_file, options) if delta else None
+        # users that failed are retried
+        done = {name for name, event in progress.items() if event in ('synced', 'disabled')}
+
+        if plan is not None:
+            users = [User(**user) for user in plan['users']]
+            diff = AccountDiff(disable=plan['disable'])
+            to_sync = [user for user in users if user.active]
+            logger.info(f"Resuming {len(to_sync)} users and {len(diff.disable)} disables, {len(done)} already done")
+        else:
+            issuer = 'https://cilogon.org/dune' if vo == 'dune' else 'https://cilogon.org/fermilab'
+            users, diff = plan_sync(ferry, client, unitname, issuer, workers, snapshot, metrics)
+            log_diff(diff)
+            # a delta run only syncs the users that changed, a full run all active users
+            changed = set(diff.add)
+            to_sync = [user for user in users if user.active and (not delta or user.name in changed)]
+            if journal is not None:
+                journal.start({'options': options,
+                               'delta': delta,
+                               'delete_accounts': delete_accounts,
+                               'users': [asdict(user) for user in to_sync]
+                                        + [asdict(user) for user in users if not user.active and user.name in diff.disable],
+                               'disable': diff.disable})
+        users_to_add = [user for user in to_sync if user.name not in done]
+
+        # Add or update users to Rucio
+        synced = {name for name, event in progress.items() if event == 'synced'}
+        if commit:
+            start = time.monotonic()
+            synced |= commit_users(ferry, client, users_to_add, scopes, analysis, emails, commit_workers, rucio_max_rate,
+                                   journal, metrics)
+            log_phase("commit", len(users_to_add), start, metrics)
+
+        # delete rucio accounts not in FERRY members or if their status has changed
+        disabled = {name for name, event in progress.items() if event == 'disabled'}
+        if delete_accounts:
+            pending = AccountDiff(disable={name: reason for name, reason in diff.disable.items() if name not in done})
+            start = time.monotonic()
+            disabled |= delete_users(client, pending, commit, journal, metrics)
+            log_phase("disable", len(pending.disable), start, metrics)
+
+        if delta and commit:
+            save_snapshot(state_file, options, update_snapshot(snapshot, users, synced, disabled))
+        if journal is not None:
+            journal.finish()
+        success = True
+    finally:
+        ferry.log_timings()
+        metrics.finish(success, ferry.timings)
+        report_metrics(metrics, statsd, metrics_file)
+        ferry.close()
+        if emails is not None:
+            emails.close()
+
+
+def plan_sync(ferry: FerryClient, client: RucioClient, unitname: str, issuer: str, workers=FERRY_WORKERS,
+              snapshot: dict[str, str] = None, metrics: SyncMetrics = None) -> tuple[list[User], AccountDiff]:
+    """
+    Fetches the affiliation from FERRY and compares it with the snapshot
+    of the last run if given, or else with the Rucio accounts
+
+    Returns the fetched users and the accounts to add, disable or keep
+    """
     filtered_users = os.getenv("FILTER_USERS", None)
+    filtered = set(filtered_users.split(',')) if filtered_users else None
 
-    # get all members and all DNs for an affiliation
+    # stream all members and all DNs for an affiliation, keeping only what the sync needs
     try:
-        members = ferry.getAffiliationMembers(unitname)[0]
-        all_dns = ferry.getAllUsersCertificateDNs(unitname)
+        start = time.monotonic()
+        affiliated, usernames = read_members(ferry.iterAffiliationMembers(unitname), filtered)
+        log_phase("members", len(affiliated), start, metrics)
+        start = time.monotonic()
+        user_dns = index_dns(ferry.iterAllUsersCertificateDNs(unitname))
+        log_phase("dns", len(user_dns), start, metrics)
     except Exception as e:
         logger.error(f"Could not get users in affiliation {unitname}")
         logger.error(e)
         raise
 
-    # filter out specific users
-    if filtered_users:
-        filtered = filtered_users.split(',')
-        members['users'] = [m for m in members['users'] if m['username'] in filtered]
+    start = time.monotonic()
+    users = fetch_users(ferry, usernames, user_dns, issuer, workers)
+    log_phase("fetch", len(usernames), start, metrics)
 
-    users_to_add = [] 
-    for user in members['users']:
-        username = user['username']
+    # compare before changing anything
+    if snapshot is not None:
+        diff = reconcile_snapshot(snapshot, affiliated, users)
+    else:
+        diff = reconcile(CallCounter(client, metrics=metrics).list_accounts(account_type="USER"), affiliated, users)
+    return users, diff
 
-        # ignore banned or deactivated users
-        try:
-            user = ferry.getUserInfo(username)
-            if not user['status'] or user['banned']:
-                continue
-        except:
-            continue
 
-        # Only incative users have no token
-        uuid = user['uuid']
-        issuer = 'https://cilogon.org/dune' if vo == 'dune' else 'https://cilogon.org/fermilab' 
+def read_members(members, filtered: set[str] = None) -> tuple[set[str], list[str]]:
+    """
+    Reads the affiliation member records, e.g. while they are streamed
+
+    Returns the usernames of all affiliated users, whose accounts are kept
+    when left out by the filter, and the ordered usernames to sync
+    """
+    affiliated = set()
+    usernames = []
+    for member in members:
+        username = member['username']
+        affiliated.add(username)
+        if filtered is None or username in filtered:
+            usernames.append(username)
+    return affiliated, usernames
 
-        # get identities
-        user_dns = list(filter(lambda x: x['username'] == username, all_dns))
-        if user_dns:
-            dn = user_dns[0]['certificates']
-        else:
-            logger.error(f"No dns for {username} found")
-            dn = []
 
-        users_to_add.append(User(name=username, identities=dn, uuid=uuid, issuer=issuer))
-    
-    # Add or update users to Rucio
-    if commit:
-        for user in users_to_add:
-            add_user(ferry, client, user, scopes, analysis)
+def index_dns(all_dns) -> dict[str, list[dict]]:
+    """
+    Indexes the getAllUsersCertificateDNs output by username
 
-    # delete rucio accounts not in FERRY members or if their status has changed
-    if delete_accounts:
-        delete_users(client, members, commit)
+    Accepts any iterable of records, so the index is built while the
+    records are streamed. The first record of a username wins.
+    """
+    user_dns = {}
+    for record in all_dns:
+        user_dns.setdefault(record['username'], record['certificates'])
+    return user_dns
 
 
-def get_email(ferry: FerryClient, username: str) -> str:
-    """Fetch email from FERRY using LDAP"""
+def fetch_users(ferry: FerryClient, usernames: list[str], user_dns: dict[str, list[dict]], issuer: str, workers=FERRY_WORKERS) -> list[User]:
+    """
+    Fetches the FERRY user info of all usernames concurrently
+
+    Users are returned in the order of usernames, skipping
+    users whose info could not be fetched
+    """
+    workers = max(1, workers)
+    logger.info(f"Fetching user info of {len(usernames)} users with {workers} workers")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        users = executor.map(lambda username: fetch_user(ferry, username, user_dns, issuer), usernames)
+        return [user for user in users if user is not None]
+
+
+def fetch_user(ferry: FerryClient, username: str, user_dns: dict[str, list[dict]], issuer: str) -> User:
+    """
+    Fetches the FERRY user info of a single user
+
+    Inactive or banned users are returned with active set to False.
+    Returns None on errors, so one failing user does not abort the sync
+    """
+    # flag banned or deactivated users
     try:
-        userLdap = ferry.getUserLdapInfo(username)
-        return userLdap['mail']
+        user = ferry.getUserInfo(username)
+        if not user['status'] or user['banned']:
+            return User(name=username, identities=[], uuid=user.get('uuid'), issuer=issuer, active=False)
+    except Exception as e:
+        logger.error(f"Could not get user info for {username}, skipping")
+        logger.error(e)
+        return None
+
+    # Only incative users have no token
+    uuid = user['uuid']
+
+    # get identities
+    if username in user_dns:
+        dn = user_dns[username]
+    else:
+        logger.error(f"No dns for {username} found")
+        dn = []
+
+    return User(name=username, identities=dn, uuid=uuid, issuer=issuer)
+
+
+def get_email(ferry: FerryClient, username: str, cache: EmailCache = None) -> str:
+    """
+    Fetch email from FERRY using LDAP, through the cache if given
+
+    Only a well-formed answer without an email is cached as such, errors
+    and malformed answers are raised without caching, so the next run asks again
+    """
+    if cache is not None:
+        found, email = cache.get(username)
+        if found:
+            if not email:
+                raise UserLDAPError(f"No LDAP email for {username} (cached)")
+            return email
+    try:
+        info = ferry.getUserLdapInfo(username)
     except Exception as e:
         raise UserLDAPError(e)
+    if not isinstance(info, dict):
+        raise UserLDAPError(f"Unexpected LDAP info for {username} from FERRY: {info!r:.200}")
+    email = info.get('mail') or None
+    if cache is not None:
+        cache.set(username, email)
+    if not email:
+        raise UserLDAPError(f"No LDAP email for {username}")
+    return email
+
+
+def log_phase(phase: str, count: int, start: float, metrics: SyncMetrics = None):
+    """
+    Logs the duration and throughput of a sync phase, and records it in the metrics if given
+    """
+    elapsed = time.monotonic() - start
+    if metrics is not None:
+        metrics.phase(phase, elapsed)
+    rate = count / elapsed if elapsed > 0 else 0.0
+    logger.info(f"Phase {phase}: {count} users in {elapsed:.1f}s ({rate:.1f} users/s)")
 
 
-def add_user(ferry: FerryClient, client: RucioClient, user: User, scopes=False, analysis=False):
+def commit_users(ferry: FerryClient, client: RucioClient, users: list[User], scopes=False, analysis=False,
+                 emails: EmailCache = None, workers=RUCIO_WORKERS, max_rate=RUCIO_MAX_RATE,
+                 journal: Journal = None, metrics: SyncMetrics = None) -> set[str]:
+    """
+    Adds or updates the users in Rucio concurrently
+
+    Each account is committed by a single worker, so its own operations keep
+    their order, while different accounts run in parallel. All workers share
+    a ceiling of max_rate Rucio requests per second. Every finished
+    user is recorded in the journal if given.
+
+    Returns the names of the users committed successfully
+    """
+    workers = max(1, workers)
+    limiter = RateLimiter(max_rate)
+    local = threading.local()
+
+    def commit(user: User) -> bool:
+        # the Rucio client is not shared between threads
+        if workers > 1 and not hasattr(local, 'client'):
+            local.client = RucioClient()
+        try:
+            ok = add_user(ferry, getattr(local, 'client', client), user, scopes, analysis, emails, limiter, metrics)
+        except Exception as e:
+            logger.error(f"Could not commit user {user.name}")
+            logger.error(e)
+            ok = False
+            if metrics is not None:
+                metrics.count('failed')
+        if journal is not None:
+            journal.record(user.name, 'synced' if ok else 'failed')
+        return ok
+
+    logger.info(f"Committing {len(users)} users with {workers} workers")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(commit, users)
+        return {user.name for user, ok in zip(users, results) if ok}
+
+
+def add_user(ferry: FerryClient, client: RucioClient, user: User, scopes=False, analysis=False,
+             emails: EmailCache = None, limiter: RateLimiter = None, metrics: SyncMetrics = None) -> bool:
     """
     Add users to Rucio
+
+    Returns False if the account could not be created or some of its identities
+    could not be added, so the next run retries the user. The outcome is counted
+    in the metrics if given: added, updated, unchanged or skipped
+    """
+    username = user.name
+    client = CallCounter(client, limiter, metrics)
+    try:
+        ok = _add_user(ferry, client, user, scopes, analysis, emails)
+    finally:
+        logger.info(f"{username}: {client.calls} Rucio API calls")
+    if metrics is not None:
+        if not ok:
+            metrics.count('skipped')
+        elif 'add_account' in client.changes:
+            metrics.count('added')
+        else:
+            metrics.count('updated' if client.changes else 'unchanged')
+    return ok
+
+
+def _add_user(ferry: FerryClient, client: RucioClient, user: User, scopes=False, analysis=False, emails: EmailCache = None) -> bool:
+    """
+    Creates the account of a user and adds its missing identities, scope and attributes
+
+    Returns False if the account or some of its identities were not added
     """
     username = user.name
-    email = ''
+    existing = None
     try:
         account = client.get_account(username)
     except AccountNotFound:
         logger.info(f"Creating account for {username}")
         try:
-            email = get_email(ferry, username)
+            email = get_email(ferry, username, emails)
         except UserLDAPError as e:
             logger.error(f"Could not get userLdapInfo for {username}, skipping")
             logger.error(e)
-            return
+            return False
         client.add_account(username, 'USER', email)
-        account = client.get_account(username)
+        account = {'email': email}
+        existing = set()
 
     email = account['email']
 
-    # Create Rucio formatted account identity
-    token_suject = f'SUB={user.uuid}, ISS={user.issuer}'
+    # prefetch the existing identities once per user, a new account has none
+    if existing is None:
+        existing = {(i['identity'], i['type']) for i in client.list_identities(username)}
+
+    # Create Rucio formatted account identities, and compute the missing ones up front
+    wanted = [(d['dn'], "X509") for d in user.identities]
+    if user.uuid:
+        wanted.append((f'SUB={user.uuid}, ISS={user.issuer}', "OIDC"))
+    missing = [identity for identity in dict.fromkeys(wanted) if identity not in existing]
 
     # add user identities
-    logger.info(f"Adding identities for {username}")
-    for d in user.identities:
+    complete = True
+    if missing:
+        logger.info(f"Adding {len(missing)} identities for {username}")
         try:
-            existing = client.list_identities(username)
-            if d['dn'] not in existing:
-                if not email:
-                    email = get_email(ferry, username)
-                client.add_identity(username, d['dn'], "X509", email)
-            if token_subject not in existing:
-                email = get_email(ferry, username)
-                client.add_identity(username, token_subject, "OIDC", email)
-
-        except Duplicate:
-            continue
+            if not email:
+                email = get_email(ferry, username, emails)
         except UserLDAPError as e:
-            logger.error(f"Could not get email for {username}, skipping")
+            logger.error(f"Could not get email for {username}, skipping identities")
             logger.error(e)
-            continue
+            missing = []
+            complete = False
+        for identity, authtype in missing:
+            try:
+                client.add_identity(username, identity, authtype, email)
+            except Duplicate:
+                continue
 
     # create a scope
     if scopes:
@@ -185,25 +769,189 @@ def add_user(ferry: FerryClient, client: RucioClient, user: User, scopes=False,
                 logger.error(e)
                 continue
 
+    return complete
+
 
-def delete_users(client: RucioClient, members, commit=False):
+class CallCounter:
     """
-    Checks and delete/disable users from Rucio
+    Wraps a client and counts the calls made through it,
+    throttling them with the limiter if given
+
+    The add_* calls that succeeded are kept in changes, and every call
+    is timed in the metrics if given. The list_* calls of the Rucio client
+    return generators, they are read into lists inside the timing
     """
-    rucio_accounts = client.list_accounts(account_type="USER")
-    ferry_accounts = [m['username'] for m in members['users']]
+    def __init__(self, client, limiter: RateLimiter = None, metrics: SyncMetrics = None):
+        self.client = client
+        self.limiter = limiter
+        self.metrics = metrics
+        self.calls = 0
+        self.changes = set()
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            if self.limiter is not None:
+                self.limiter.wait()
+            self.calls += 1
+            start = time.monotonic()
+            try:
+                result = attr(*args, **kwargs)
+                if name.startswith('list_'):
+                    result = list(result)
+            finally:
+                if self.metrics is not None:
+                    self.metrics.request('rucio', name, time.monotonic() - start)
+            if name.startswith('add_'):
+                self.changes.add(name)
+            return result
+        return call
+
+
+def reconcile(rucio_accounts, affiliated: set[str], users: list[User]) -> AccountDiff:
+    """
+    Computes which accounts to add, disable or keep in a single pass
+    over the Rucio USER accounts
+
+    Accounts of affiliated users whose FERRY info could not be fetched
+    are kept, so FERRY errors never disable accounts
+    """
+    active = {user.name for user in users if user.active}
+    inactive = {user.name for user in users if not user.active}
+    diff = AccountDiff()
+    existing = set()
     for a in rucio_accounts:
-        if a['account'] not in ferry_accounts:
-            logger.info(f"Disabling account {a}, account not affiliated")
-            if commit:
-                client.delete_account(a)
+        account = a['account']
+        existing.add(account)
+        if account not in affiliated:
+            diff.disable[account] = "account not affiliated"
+        elif account in inactive:
+            diff.disable[account] = "FERRY disabled or banned"
+        else:
+            diff.keep.append(account)
+    diff.add = sorted(active - existing)
+    diff.disable = dict(sorted(diff.disable.items()))
+    diff.keep.sort()
+    return diff
+
+
+def log_diff(diff: AccountDiff):
+    """
+    Logs the counts and names of the reconciliation
+    """
+    logger.info(f"Accounts to add: {len(diff.add)}, to disable: {len(diff.disable)}, to keep: {len(diff.keep)}")
+    if diff.add:
+        logger.info(f"Add: {', '.join(diff.add)}")
+    if diff.disable:
+        logger.info(f"Disable: {', '.join(diff.disable)}")
+    logger.debug(f"Keep: {', '.join(diff.keep)}")
+
+
+def load_snapshot(path: str, options: dict) -> dict[str, str]:
+    """
+    Loads the username -> digest snapshot of the last committed run
+
+    Returns an empty snapshot, so every user is synced, if there is none
+    or if it was written with different sync options
+    """
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        logger.info(f"No snapshot at {path}, syncing all users")
+        return {}
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not read snapshot {path}, syncing all users")
+        logger.error(e)
+        return {}
+    if state.get('options') != options:
+        logger.info("Sync options changed since the snapshot, syncing all users")
+        return {}
+    return state['users']
+
+
+def save_snapshot(path: str, options: dict, snapshot: dict[str, str]):
+    """
+    Atomically replaces the snapshot
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump({'options': options, 'users': snapshot}, f, separators=(',', ':'), sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    logger.info(f"Saved snapshot of {len(snapshot)} users to {path}")
+
+
+def reconcile_snapshot(snapshot: dict[str, str], affiliated: set[str], users: list[User]) -> AccountDiff:
+    """
+    Computes which accounts changed since the snapshot
+
+    Active users whose digest changed are added or updated, users that
+    became inactive or left the affiliation since the snapshot are disabled
+    and everything else is kept, without listing the Rucio accounts
+    """
+    diff = AccountDiff()
+    for user in users:
+        if snapshot.get(user.name) == user.digest():
+            diff.keep.append(user.name)
+        elif user.active:
+            diff.add.append(user.name)
+        else:
+            diff.disable[user.name] = "FERRY disabled or banned"
+    for name in snapshot:
+        if name not in affiliated:
+            diff.disable[name] = "account not affiliated"
+    diff.add.sort()
+    diff.disable = dict(sorted(diff.disable.items()))
+    diff.keep.sort()
+    return diff
+
+
+def update_snapshot(snapshot: dict[str, str], users: list[User], synced: set[str], disabled: set[str]) -> dict[str, str]:
+    """
+    Records the users synced and disabled by this run in the snapshot
+
+    Users that failed keep their previous digest, so the next run retries them
+    """
+    digests = {user.name: user.digest() for user in users}
+    snapshot = dict(snapshot)
+    for name in synced:
+        snapshot[name] = digests[name]
+    for name in disabled:
+        if name in digests:
+            snapshot[name] = digests[name]
         else:
-            index = ferry_accounts.index(a['account'])
-            user = members[index]
-            if not user['status'] or user['banned']:
-                logger.info(f"Disabling account {a}, FERRY disabled or banned")
-                if commit:
-                    client.delete_account(a)
+            snapshot.pop(name, None)
+    return snapshot
+
+
+def delete_users(client: RucioClient, diff: AccountDiff, commit=False, journal: Journal = None,
+                 metrics: SyncMetrics = None) -> set[str]:
+    """
+    Checks and delete/disable users from Rucio
+
+    Returns the accounts that were disabled
+    """
+    client = CallCounter(client, metrics=metrics)
+    disabled = set()
+    for account, reason in diff.disable.items():
+        logger.info(f"Disabling account {account}, {reason}")
+        if commit:
+            try:
+                client.delete_account(account)
+            except AccountNotFound:
+                logger.info(f"Account {account} is already disabled")
+            disabled.add(account)
+            if metrics is not None:
+                metrics.count('disabled')
+            if journal is not None:
+                journal.record(account, 'disabled')
+    return disabled
 
 
 def main():
@@ -224,13 +972,65 @@ def main():
                         help=f'add the following analysis account attributes: {ANALYSIS_ATTRIBUTES}',
                         dest='analysis',
                         action='store_true')
+    parser.add_argument('--workers',
+                        help=f'number of concurrent FERRY user info requests (default: {FERRY_WORKERS})',
+                        type=int,
+                        default=FERRY_WORKERS)
+    parser.add_argument('--max_rate',
+                        help='maximum FERRY requests per second, 0 for no limit (default: $FERRY_MAX_RATE or 20)',
+                        type=float,
+                        default=None)
+    parser.add_argument('--commit_workers',
+                        help=f'number of accounts committed to Rucio concurrently (default: {RUCIO_WORKERS})',
+                        type=int,
+                        default=RUCIO_WORKERS)
+    parser.add_argument('--rucio_max_rate',
+                        help=f'maximum Rucio requests per second while committing, 0 for no limit (default: {RUCIO_MAX_RATE})',
+                        type=float,
+                        default=RUCIO_MAX_RATE)
+    parser.add_argument('--delta',
+                        help='only sync users that changed since the snapshot of the last committed run, '
+                             'accounts never seen by a delta run are not disabled, run without it to fully reconcile',
+                        action='store_true')
+    parser.add_argument('--state_file',
+                        help=f'snapshot file used by --delta (default: {STATE_FILE})',
+                        default=STATE_FILE)
+    parser.add_argument('--journal_file',
+                        help=f'progress journal of committing runs, used by --resume (default: {JOURNAL_FILE})',
+                        default=JOURNAL_FILE)
+    parser.add_argument('--resume',
+                        help='continue the plan of an interrupted run from its journal, unless it started more than '
+                             f'{JOURNAL_MAX_AGE}s ago or was resumed {JOURNAL_MAX_RESUMES} times already. --commit is required',
+                        action='store_true')
+    parser.add_argument('--email_cache',
+                        help=f'SQLite cache of LDAP emails, empty to disable (default: {EMAIL_CACHE})',
+                        default=EMAIL_CACHE)
+    parser.add_argument('--statsd',
+                        help='statsd host:port to send the metrics of the run to, e.g. localhost:8125 (default: $FERRY_STATSD)',
+                        default=STATSD)
+    parser.add_argument('--metrics_file',
+                        help='Prometheus textfile to write the metrics of the run to (default: $FERRY_METRICS_FILE)',
+                        default=METRICS_FILE)
 
     args = parser.parse_args()
+    if args.resume and not args.commit:
+        parser.error('--resume requires --commit')
 
     sync_ferry_users(commit=args.commit,
                     delete_accounts=args.delete_accounts,
                     scopes=args.scopes,
-                    analysis=args.analysis)
+                    analysis=args.analysis,
+                    workers=args.workers,
+                    max_rate=args.max_rate,
+                    delta=args.delta,
+                    state_file=args.state_file,
+                    email_cache=args.email_cache,
+                    commit_workers=args.commit_workers,
+                    rucio_max_rate=args.rucio_max_rate,
+                    journal_file=args.journal_file,
+                    resume=args.resume,
+                    statsd=args.statsd,
+                    metrics_file=args.metrics_file)
 
 
 if __name__ == "__main__":
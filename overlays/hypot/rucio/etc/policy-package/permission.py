@@ -12,23 +12,376 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import TYPE_CHECKING, Any
-
-import rucio.core.scope
+import atexit
+import json
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from hashlib import sha1
+from threading import Lock, Thread
+from time import monotonic, sleep, time
+from typing import TYPE_CHECKING, Any, NamedTuple
+from uuid import uuid4
+
+import stomp
+from dogpile.cache.api import NO_VALUE
+from sqlalchemy import event, select
+
+from rucio.common.cache import ENABLE_CACHING, MemcacheRegion
+from rucio.common.config import config_get, config_get_int, config_get_list
 from rucio.common.constants import RseAttr
-from rucio.core.account import has_account_attribute, list_account_attributes
+from rucio.common.exception import AccountNotFound
+from rucio.common.types import InternalAccount, InternalScope
+from rucio.core.account import list_account_attributes
 from rucio.core.identity import exist_identity_account
 from rucio.core.lifetime_exception import list_exceptions
-from rucio.core.rse import list_rse_attributes
+from rucio.core.message import add_message
+from rucio.core.monitor import MetricManager
 from rucio.core.rse_expression_parser import parse_expression
+from rucio.db.sqla import models
 from rucio.db.sqla.constants import IdentityType
+from rucio.db.sqla.session import read_session
 
 if TYPE_CHECKING:
+    from collections.abc import Callable, Hashable, Iterable
     from typing import Optional
 
     from sqlalchemy.orm import Session
-
-    from rucio.common.types import InternalAccount
+    from stomp.utils import Frame
+
+METRICS = MetricManager(module=__name__)
+
+ATTRIBUTE_CACHE_TTL = config_get_int('policy', 'attribute_cache_ttl', raise_exception=False, default=300, check_config_table=False)
+ATTRIBUTE_CACHE_SIZE = config_get_int('policy', 'attribute_cache_size', raise_exception=False, default=10000, check_config_table=False)
+RSE_CACHE_TTL = config_get_int('policy', 'rse_cache_ttl', raise_exception=False, default=300, check_config_table=False)
+RSE_EXPRESSION_CACHE_SIZE = config_get_int('policy', 'rse_expression_cache_size', raise_exception=False, default=1000, check_config_table=False)
+DECISION_CACHE_TTL = config_get_int('policy', 'decision_cache_ttl', raise_exception=False, default=0, check_config_table=False)
+DECISION_CACHE_SIZE = config_get_int('policy', 'decision_cache_size', raise_exception=False, default=10000, check_config_table=False)
+IDENTITY_CACHE_TTL = config_get_int('policy', 'identity_cache_ttl', raise_exception=False, default=60, check_config_table=False)
+IDENTITY_NEGATIVE_CACHE_TTL = config_get_int('policy', 'identity_negative_cache_ttl', raise_exception=False, default=5, check_config_table=False)
+IDENTITY_CACHE_SIZE = config_get_int('policy', 'identity_cache_size', raise_exception=False, default=10000, check_config_table=False)
+SHARED_CACHE_TTL = config_get_int('policy', 'shared_cache_ttl', raise_exception=False, default=300, check_config_table=False)
+SHARED_CACHE_STAMP_INTERVAL = config_get_int('policy', 'shared_cache_stamp_interval', raise_exception=False, default=5, check_config_table=False)
+INVALIDATION_BROKERS = config_get_list('policy', 'invalidation_brokers', raise_exception=False, default=[], check_config_table=False)
+INVALIDATION_PORT = config_get_int('policy', 'invalidation_port', raise_exception=False, default=61613, check_config_table=False)
+INVALIDATION_VHOST = config_get('policy', 'invalidation_vhost', raise_exception=False, default='/', check_config_table=False)
+INVALIDATION_DESTINATION = config_get('policy', 'invalidation_destination', raise_exception=False, default='/topic/rucio.events', check_config_table=False)
+INVALIDATION_USERNAME = config_get('policy', 'invalidation_username', raise_exception=False, default='guest', check_config_table=False)
+INVALIDATION_PASSWORD = config_get('policy', 'invalidation_password', raise_exception=False, default='guest', check_config_table=False)
+INVALIDATION_RECONNECT_INTERVAL = 10
+METRICS_FLUSH_INTERVAL = config_get_int('policy', 'metrics_flush_interval', raise_exception=False, default=10, check_config_table=False)
+
+
+class _CounterBatch:
+    """
+    Thread-safe tally of the counters incremented by the permission checks,
+    sent to the Rucio metrics (statsd and prometheus) at most every
+    METRICS_FLUSH_INTERVAL seconds and at exit, instead of once per lookup.
+    """
+    def __init__(self) -> None:
+        self._counts: Counter[tuple[str, tuple[tuple[str, str], ...]]] = Counter()
+        self._flushed = monotonic()
+        self._lock = Lock()
+
+    def inc(self, name: str, delta: int = 1, **labels: str) -> None:
+        """
+        Adds to a counter, sending all of them once the flush interval passed.
+
+        :param name: The metric name, with a placeholder for each label.
+        :param delta: The increment.
+        :param labels: The values of the placeholders.
+        """
+        now = monotonic()
+        with self._lock:
+            self._counts[name, tuple(labels.items())] += delta
+            due = now >= self._flushed + METRICS_FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Sends the increments counted since the last flush.
+        """
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            self._flushed = monotonic()
+        for (name, labels), delta in counts.items():
+            METRICS.counter(name).labels(**dict(labels)).inc(delta)
+
+
+_COUNTERS = _CounterBatch()
+atexit.register(_COUNTERS.flush)
+
+
+class _TTLCache:
+    """
+    Bounded, thread-safe LRU cache whose entries expire a fixed time after being stored.
+
+    Hits, misses and evictions are counted per cache name and exported through
+    the Rucio metrics (statsd and prometheus) in batches.
+    """
+    def __init__(self, name: str, ttl: int, maxsize: int) -> None:
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: OrderedDict["Hashable", tuple[float, Any]] = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: "Hashable", default: Any = None) -> Any:
+        """
+        Returns the cached value for the key, or the default if it is missing or expired.
+        """
+        hit = expired = False
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > monotonic():
+                    self._entries.move_to_end(key)
+                    hit = True
+                else:
+                    del self._entries[key]
+                    expired = True
+        if hit:
+            _COUNTERS.inc('cache.{cache}.hit', cache=self.name)
+            return entry[1]
+        if expired:
+            _COUNTERS.inc('cache.{cache}.eviction.{reason}', cache=self.name, reason='expired')
+        _COUNTERS.inc('cache.{cache}.miss', cache=self.name)
+        return default
+
+    def set(self, key: "Hashable", value: Any, ttl: "Optional[int]" = None) -> None:
+        """
+        Stores a value, evicting the least recently used entries above the size limit.
+
+        :param ttl: Seconds the value is kept for, the TTL of the cache by default.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        evicted = 0
+        with self._lock:
+            self._entries[key] = (monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                evicted += 1
+        if evicted:
+            _COUNTERS.inc('cache.{cache}.eviction.{reason}', evicted, cache=self.name, reason='size')
+
+    def evict(self, key: "Hashable") -> None:
+        """
+        Removes the entry for the key, if any.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            _COUNTERS.inc('cache.{cache}.eviction.{reason}', cache=self.name, reason='invalidated')
+
+    def clear(self) -> None:
+        """
+        Removes all entries.
+        """
+        with self._lock:
+            evicted = len(self._entries)
+            self._entries.clear()
+        if evicted:
+            _COUNTERS.inc('cache.{cache}.eviction.{reason}', evicted, cache=self.name, reason='invalidated')
+
+
+# Memcached region shared by all server processes, None without memcached
+_SHARED_REGION = MemcacheRegion(expiration_time=SHARED_CACHE_TTL) if ENABLE_CACHING and SHARED_CACHE_TTL > 0 else None
+
+
+class _SharedCache:
+    """
+    Cache shared by all server processes through memcached, consulted after the
+    per-process cache, if any, and before the database.
+
+    Each namespace has a version stamp stored in memcached, and entries are keyed
+    by the stamp they were stored under, so writing a new stamp hides them from
+    every process at once. The stamp is stored without expiry, directly through
+    the memcached client rather than as an expiring region value, and created
+    with an atomic add, so all processes agree on it. Processes re-read the stamp at most every
+    SHARED_CACHE_STAMP_INTERVAL seconds and clear their per-process cache of the
+    namespace, and the caches derived from it, when it moved. Without memcached
+    every shared lookup misses, and memcached errors are counted and treated as
+    misses.
+    """
+    def __init__(self, namespace: str, local: "Optional[_TTLCache]" = None, dependents: "Iterable[_TTLCache]" = ()) -> None:
+        self.namespace = namespace
+        self.local = local
+        self.dependents = list(dependents)
+        self._stamp: "Optional[str]" = None
+        self._checked = float('-inf')
+        self._lock = Lock()
+
+    def _stamp_key(self) -> str:
+        return f'fermilab.permission.{self.namespace}.stamp'
+
+    def _key(self, key: "Hashable") -> str:
+        return f'fermilab.permission.{self.namespace}.{self._stamp}.{sha1(repr(key).encode()).hexdigest()}'
+
+    def _error(self) -> None:
+        METRICS.counter('shared_cache.{cache}.error').labels(cache=self.namespace).inc()
+
+    def _read_stamp(self) -> str:
+        """
+        Returns the stamp of the namespace, creating it if no process did yet.
+        """
+        client = _SHARED_REGION.backend.client
+        stamp = client.get(self._stamp_key())
+        if stamp is None:
+            # only the first add stores a stamp, every process then reads that one
+            client.add(self._stamp_key(), uuid4().hex, expire=0, noreply=False)
+            stamp = client.get(self._stamp_key())
+            if stamp is None:
+                raise RuntimeError(f'The stamp of {self.namespace} could not be stored')
+        return stamp
+
+    def refresh(self) -> None:
+        """
+        Re-reads the stamp of the namespace once the check interval passed,
+        clearing the per-process cache when another process invalidated it.
+        """
+        if _SHARED_REGION is None or monotonic() < self._checked + SHARED_CACHE_STAMP_INTERVAL:
+            return
+        with self._lock:
+            if monotonic() < self._checked + SHARED_CACHE_STAMP_INTERVAL:
+                return
+            try:
+                stamp = self._read_stamp()
+            except Exception:
+                self._error()
+                stamp = None
+            if stamp != self._stamp:
+                for cache in [self.local, *self.dependents]:
+                    if cache is not None:
+                        cache.clear()
+            self._stamp = stamp
+            self._checked = monotonic()
+
+    def get(self, key: "Hashable", default: Any = None) -> Any:
+        """
+        Returns the value for the key from the per-process cache, or else from
+        memcached, or the default if both miss.
+        """
+        return self.get_multi([key]).get(key, default)
+
+    def get_multi(self, keys: "Iterable[Hashable]") -> dict["Hashable", Any]:
+        """
+        Returns the values of the keys found in the per-process cache, and of
+        the remaining ones found in memcached in a single round trip.
+        """
+        self.refresh()
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.local.get(key, NO_VALUE) if self.local is not None else NO_VALUE
+            if value is NO_VALUE:
+                missing.append(key)
+            else:
+                found[key] = value
+        if self._stamp is None or not missing:
+            return found
+        try:
+            values = _SHARED_REGION.get_multi([self._key(key) for key in missing])
+        except Exception:
+            self._error()
+            return found
+        shared = {key: value for key, value in zip(missing, values) if value is not NO_VALUE}
+        if shared:
+            _COUNTERS.inc('shared_cache.{cache}.hit', len(shared), cache=self.namespace)
+            if self.local is not None:
+                for key, value in shared.items():
+                    self.local.set(key, value)
+        if len(shared) < len(missing):
+            _COUNTERS.inc('shared_cache.{cache}.miss', len(missing) - len(shared), cache=self.namespace)
+        found.update(shared)
+        return found
+
+    def set(self, key: "Hashable", value: Any) -> None:
+        """
+        Stores a value in the per-process cache and in memcached.
+        """
+        self.set_multi({key: value})
+
+    def set_multi(self, mapping: dict["Hashable", Any]) -> None:
+        """
+        Stores values in the per-process cache, and in memcached in a single round trip.
+        """
+        if self.local is not None:
+            for key, value in mapping.items():
+                self.local.set(key, value)
+        if self._stamp is None or not mapping:
+            return
+        try:
+            _SHARED_REGION.set_multi({self._key(key): value for key, value in mapping.items()})
+        except Exception:
+            self._error()
+
+    def invalidate(self, *, session: "Optional[Session]" = None) -> None:
+        """
+        Writes a new stamp of the namespace before a change, and again once the
+        session commits, so every process drops the entries read before it.
+
+        :param session: The DB session making the change
+        """
+        def bump(*_) -> None:
+            if _SHARED_REGION is None:
+                return
+            stamp = uuid4().hex
+            try:
+                _SHARED_REGION.backend.client.set(self._stamp_key(), stamp, expire=0, noreply=False)
+            except Exception:
+                self._error()
+                return
+            with self._lock:
+                self._stamp = stamp
+                self._checked = monotonic()
+
+        bump()
+        if session is not None:
+            event.listen(session, 'after_commit', bump, once=True)
+
+
+class _AccountAttributes(NamedTuple):
+    """
+    The account attributes the permission checks depend on.
+    """
+    admin: bool
+    admin_in_country: frozenset[str]
+
+
+@dataclass
+class _RequestCache:
+    """
+    Lookups shared by all permission checks issued within one request.
+    """
+    attributes: dict["InternalAccount", _AccountAttributes] = field(default_factory=dict)
+    scope_owners: dict["InternalScope", "Optional[InternalAccount]"] = field(default_factory=dict)
+
+
+_REQUEST_CACHE_KEY = 'fermilab.permission'
+_REQUEST_CACHE: ContextVar["Optional[_RequestCache]"] = ContextVar(_REQUEST_CACHE_KEY, default=None)
+
+# Decisions of the cacheable actions keyed by (issuer, action, relevant kwargs), derived from the account attributes
+_DECISION_CACHE = _TTLCache('decisions', ttl=DECISION_CACHE_TTL, maxsize=DECISION_CACHE_SIZE)
+# Parsed account attributes keyed by (vo, account), shared by all requests of the process
+_ATTRIBUTE_CACHE = _TTLCache('attributes', ttl=ATTRIBUTE_CACHE_TTL, maxsize=ATTRIBUTE_CACHE_SIZE)
+_SHARED_ATTRIBUTES = _SharedCache('attributes', local=_ATTRIBUTE_CACHE, dependents=[_DECISION_CACHE])
+# Owners of existing scopes, which never change, and identity to account associations
+_SCOPE_OWNER_CACHE = _TTLCache('scope_owners', ttl=ATTRIBUTE_CACHE_TTL, maxsize=ATTRIBUTE_CACHE_SIZE)
+_SHARED_SCOPE_OWNERS = _SharedCache('scope_owners', local=_SCOPE_OWNER_CACHE)
+# Known identity to account associations, and missing ones for IDENTITY_NEGATIVE_CACHE_TTL
+_IDENTITY_CACHE = _TTLCache('identities', ttl=IDENTITY_CACHE_TTL, maxsize=IDENTITY_CACHE_SIZE)
+_SHARED_IDENTITIES = _SharedCache('identities', local=_IDENTITY_CACHE)
+# Identity lookups of the token endpoints, keyed by (endpoint, cache hit)
+_IDENTITY_LOOKUPS: Counter[tuple[str, bool]] = Counter()
+_IDENTITY_LOOKUPS_LOCK = Lock()
+# Country of every RSE keyed by RSE id, stored as a single entry
+_RSE_COUNTRY_CACHE = _TTLCache('rse_countries', ttl=RSE_CACHE_TTL, maxsize=1)
+# RSE ids an expression resolves to, keyed by (vo, expression)
+_RSE_EXPRESSION_CACHE = _TTLCache('rse_expressions', ttl=RSE_CACHE_TTL, maxsize=RSE_EXPRESSION_CACHE_SIZE)
 
 
 def has_permission(issuer: "InternalAccount", action: str, kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
@@ -42,814 +395,858 @@ def has_permission(issuer: "InternalAccount", action: str, kwargs: dict[str, Any
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    perm = {'add_account': perm_add_account,
-            'del_account': perm_del_account,
-            'update_account': perm_update_account,
-            'add_rule': perm_add_rule,
-            'add_subscription': perm_add_subscription,
-            'add_scope': perm_add_scope,
-            'add_rse': perm_add_rse,
-            'update_rse': perm_update_rse,
-            'add_protocol': perm_add_protocol,
-            'del_protocol': perm_del_protocol,
-            'update_protocol': perm_update_protocol,
-            'add_qos_policy': perm_add_qos_policy,
-            'delete_qos_policy': perm_delete_qos_policy,
-            'declare_bad_file_replicas': perm_declare_bad_file_replicas,
-            'declare_suspicious_file_replicas': perm_declare_suspicious_file_replicas,
-            'add_replicas': perm_add_replicas,
-            'delete_replicas': perm_delete_replicas,
-            'skip_availability_check': perm_skip_availability_check,
-            'update_replicas_states': perm_update_replicas_states,
-            'add_rse_attribute': perm_add_rse_attribute,
-            'del_rse_attribute': perm_del_rse_attribute,
-            'del_rse': perm_del_rse,
-            'del_rule': perm_del_rule,
-            'update_rule': perm_update_rule,
-            'approve_rule': perm_approve_rule,
-            'update_subscription': perm_update_subscription,
-            'reduce_rule': perm_reduce_rule,
-            'move_rule': perm_move_rule,
-            'get_auth_token_user_pass': perm_get_auth_token_user_pass,
-            'get_auth_token_gss': perm_get_auth_token_gss,
-            'get_auth_token_x509': perm_get_auth_token_x509,
-            'get_auth_token_saml': perm_get_auth_token_saml,
-            'add_account_identity': perm_add_account_identity,
-            'add_did': perm_add_did,
-            'add_dids': perm_add_dids,
-            'attach_dids': perm_attach_dids,
-            'detach_dids': perm_detach_dids,
-            'attach_dids_to_dids': perm_attach_dids_to_dids,
-            'create_did_sample': perm_create_did_sample,
-            'set_metadata': perm_set_metadata,
-            'set_metadata_bulk': perm_set_metadata_bulk,
-            'set_status': perm_set_status,
-            'queue_requests': perm_queue_requests,
-            'set_rse_usage': perm_set_rse_usage,
-            'set_rse_limits': perm_set_rse_limits,
-            'list_requests': perm_list_requests,
-            'list_requests_history': perm_list_requests_history,
-            'get_request_by_did': perm_get_request_by_did,
-            'get_request_history_by_did': perm_get_request_history_by_did,
-            'cancel_request': perm_cancel_request,
-            'get_next': perm_get_next,
-            'set_local_account_limit': perm_set_local_account_limit,
-            'set_global_account_limit': perm_set_global_account_limit,
-            'delete_local_account_limit': perm_delete_local_account_limit,
-            'delete_global_account_limit': perm_delete_global_account_limit,
-            'config_sections': perm_config,
-            'config_add_section': perm_config,
-            'config_has_section': perm_config,
-            'config_options': perm_config,
-            'config_has_option': perm_config,
-            'config_get': perm_config,
-            'config_items': perm_config,
-            'config_set': perm_config,
-            'config_remove_section': perm_config,
-            'config_remove_option': perm_config,
-            'get_local_account_usage': perm_get_local_account_usage,
-            'get_global_account_usage': perm_get_global_account_usage,
-            'add_attribute': perm_add_account_attribute,
-            'del_attribute': perm_del_account_attribute,
-            'list_heartbeats': perm_list_heartbeats,
-            'resurrect': perm_resurrect,
-            'update_lifetime_exceptions': perm_update_lifetime_exceptions,
-            'get_auth_token_ssh': perm_get_auth_token_ssh,
-            'get_signed_url': perm_get_signed_url,
-            'add_bad_pfns': perm_add_bad_pfns,
-            'del_account_identity': perm_del_account_identity,
-            'del_identity': perm_del_identity,
-            'remove_did_from_followed': perm_remove_did_from_followed,
-            'remove_dids_from_followed': perm_remove_dids_from_followed,
-            'export': perm_export}
-
-    return perm.get(action, perm_default)(issuer=issuer, kwargs=kwargs, session=session)
-
-
-def _is_root(issuer) -> bool:
-    return issuer.external == 'root'
-
+    _INVALIDATION_SUBSCRIBER.start()
+    token = _REQUEST_CACHE.set(_request_cache(session))
+    try:
+        return _decide(issuer, action, kwargs, session=session)
+    finally:
+        _REQUEST_CACHE.reset(token)
 
-def perm_default(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
-    """
-    Default permission.
 
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
-    :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
+def has_permissions(issuer: "InternalAccount", checks: "Iterable[tuple[str, dict[str, Any]]]", *, session: "Optional[Session]" = None) -> list[bool]:
     """
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
-
+    Checks if an account has the permissions to execute several actions with
+    parameters.
 
-def perm_add_rse(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
-    """
-    Checks if an account can add a RSE.
+    The checks share the lookups of one request, so the attributes of the
+    issuer are read once, and the owners of the scopes of all the checks are
+    resolved together in one query before the first check runs.
 
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
+    :param issuer: Account identifier which issues the commands.
+    :param checks: The (action, kwargs) pairs to check.
     :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
+    :returns: The decision of every check, in the order of the checks
     """
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
+    checks = list(checks)
+    _INVALIDATION_SUBSCRIBER.start()
+    token = _REQUEST_CACHE.set(_request_cache(session))
+    try:
+        scopes = {scope for action, kwargs in checks if action in _SCOPE_ARGUMENTS
+                  for scope in _SCOPE_ARGUMENTS[action](kwargs) if scope is not None}
+        if scopes and not _is_root(issuer) and not _is_admin(issuer, session=session):
+            _scope_owners(scopes, session=session)
+        return [_decide(issuer, action, kwargs, session=session) for action, kwargs in checks]
+    finally:
+        _REQUEST_CACHE.reset(token)
 
 
-def perm_update_rse(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def _decide(issuer: "InternalAccount", action: str, kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can update a RSE.
+    Applies the rule of an action, reusing the decisions of the actions tagged
+    in _CACHEABLE_ACTIONS for DECISION_CACHE_TTL seconds.
 
     :param issuer: Account identifier which issues the command.
+    :param action: The action(API call) called by the account.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
+    relevant = _CACHEABLE_ACTIONS.get(action) if DECISION_CACHE_TTL > 0 else None
+    if relevant is None:
+        return _PERMISSIONS.get(action, perm_default)(issuer=issuer, kwargs=kwargs, session=session)
+    _SHARED_ATTRIBUTES.refresh()
+    key = (issuer.internal, action, tuple(_normalize(kwargs.get(name)) for name in relevant))
+    decision = _DECISION_CACHE.get(key)
+    if decision is None:
+        decision = _PERMISSIONS.get(action, perm_default)(issuer=issuer, kwargs=kwargs, session=session)
+        _DECISION_CACHE.set(key, decision)
+    return decision
 
 
-def perm_add_rule(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def _normalize(value: Any) -> "Hashable":
     """
-    Checks if an account can add a replication rule.
-
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
-    :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
+    Returns a hashable form of a keyword argument, equal for arguments that
+    only differ in the order of their items.
     """
-    if kwargs['account'] == issuer and not kwargs['locked']:
-        return True
-    if _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session):
-        return True
-    return False
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(sorted(str(item) for item in value))
+    return str(value)
 
 
-def perm_add_subscription(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def _request_cache(session: "Optional[Session]") -> _RequestCache:
     """
-    Checks if an account can add a subscription.
+    Returns the lookup cache of the request the session belongs to.
+
+    Rucio opens one session per API call, so the session info dictionary lives
+    exactly as long as the request, including bulk calls that check permissions
+    once per item. Checks without a session get a cache of their own.
 
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
     :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
+    :returns: The request cache
     """
-    if _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session):
-        return True
-    return False
+    if session is None:
+        return _RequestCache()
+    return session.info.setdefault(_REQUEST_CACHE_KEY, _RequestCache())
 
 
-def perm_add_rse_attribute(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
-    """
-    Checks if an account can add a RSE attribute.
-
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
-    :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
-    """
-    if _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session):
-        return True
-    return False
+def _is_root(issuer) -> bool:
+    return issuer.external == 'root'
 
 
-def perm_del_rse_attribute(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def _load_account_attributes(account: "InternalAccount", *, session: "Optional[Session]" = None) -> _AccountAttributes:
     """
-    Checks if an account can delete a RSE attribute.
+    Loads the attributes of an account with a single query.
 
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
+    :param account: The account to load the attributes of.
     :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
+    :returns: The parsed account attributes
     """
-    if _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session):
-        return True
-    return False
+    try:
+        attributes = list_account_attributes(account=account, session=session)
+    except AccountNotFound:
+        attributes = []
+    return _AccountAttributes(admin=any(kv['key'] == 'admin' for kv in attributes),
+                              admin_in_country=frozenset(kv['key'].partition('-')[2] for kv in attributes
+                                                         if kv['key'].startswith('country-') and kv['value'] == 'admin'))
 
 
-def perm_del_rse(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def _account_attributes(account: "InternalAccount", *, session: "Optional[Session]" = None) -> _AccountAttributes:
     """
-    Checks if an account can delete a RSE.
+    Returns the attributes of an account from the snapshot of the current request,
+    falling back to the process-wide cache and loading them on first use.
 
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
+    :param account: The account to get the attributes of.
     :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
+    :returns: The parsed account attributes
     """
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
+    cache = _REQUEST_CACHE.get()
+    if cache is not None and account in cache.attributes:
+        _COUNTERS.inc('attributes.lookups_avoided')
+        return cache.attributes[account]
+    attributes = _SHARED_ATTRIBUTES.get((account.vo, account.external))
+    if attributes is not None:
+        _COUNTERS.inc('attributes.lookups_avoided')
+    else:
+        attributes = _load_account_attributes(account, session=session)
+        _SHARED_ATTRIBUTES.set((account.vo, account.external), attributes)
+    if cache is not None:
+        cache.attributes[account] = attributes
+    return attributes
 
 
-def perm_add_account(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def _invalidate_account_attributes(account: "InternalAccount", *, session: "Optional[Session]" = None) -> None:
     """
-    Checks if an account can add an account.
+    Drops the cached attributes of an account that is about to change.
 
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
-    :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
-    """
-    return _is_root(issuer)
+    The entry is evicted again once the session commits, so a concurrent request
+    cannot keep the attributes read before the change in the cache. The cached
+    decisions are dropped along with it. The shared attributes are invalidated
+    as a whole, as the other processes do not know which account changed.
 
-
-def perm_del_account(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+    :param account: The account whose attributes change.
+    :param session: The DB session making the change
     """
-    Checks if an account can del an account.
+    key = (account.vo, account.external)
 
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
-    :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
-    """
-    return _is_root(issuer)
+    def evict(*_) -> None:
+        _ATTRIBUTE_CACHE.evict(key)
+        _DECISION_CACHE.clear()
 
+    evict()
+    cache = _REQUEST_CACHE.get()
+    if cache is not None:
+        cache.attributes.pop(account, None)
+    if session is not None:
+        event.listen(session, 'after_commit', evict, once=True)
+    _SHARED_ATTRIBUTES.invalidate(session=session)
+    if _publishing(session):
+        _publish(_ACCOUNT_ATTRIBUTE_CHANGE, {'account': account.external, 'vo': account.vo}, session=session)
 
-def perm_update_account(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
-    """
-    Checks if an account can update an account.
 
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
-    :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
-    """
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
+def _is_admin(issuer: "InternalAccount", *, session: "Optional[Session]" = None) -> bool:
+    return _account_attributes(issuer, session=session).admin
 
 
-def perm_add_scope(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+@read_session
+def _load_scope_owners(scopes: "Iterable[InternalScope]", *, session: "Session") -> dict["InternalScope", "InternalAccount"]:
     """
-    Checks if an account can add a scop to a account.
+    Loads the owners of a set of scopes with a single query.
 
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
+    :param scopes: The scopes to resolve.
     :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
+    :returns: A dictionary of scope to owner account, for the scopes that exist
     """
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
+    stmt = select(
+        models.Scope.scope,
+        models.Scope.account
+    ).where(
+        models.Scope.scope.in_(scopes)
+    )
+    return {scope: account for scope, account in session.execute(stmt)}
 
 
-def perm_get_auth_token_user_pass(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def _scope_owners(scopes: "Iterable[InternalScope]", *, session: "Optional[Session]" = None) -> dict["InternalScope", "Optional[InternalAccount]"]:
     """
-    Checks if a user can request a token with user_pass for an account.
+    Returns the owners of the scopes, resolving those not yet known to the
+    current request from the process and shared caches, and the remaining
+    ones in one query.
 
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
+    :param scopes: The scopes to resolve.
     :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
+    :returns: A dictionary of scope to owner account, None for unknown scopes
     """
-    if exist_identity_account(identity=kwargs['username'], type_=IdentityType.USERPASS, account=kwargs['account'], session=session):
-        return True
-    return False
+    cache = _REQUEST_CACHE.get()
+    known = cache.scope_owners if cache is not None else {}
+    scopes = set(scopes)
+    missing = scopes.difference(known)
+    if len(missing) < len(scopes):
+        _COUNTERS.inc('scope_owners.lookups_avoided', len(scopes) - len(missing))
+    if missing:
+        shared = _SHARED_SCOPE_OWNERS.get_multi(missing)
+        known.update(shared)
+        missing.difference_update(shared)
+    if missing:
+        owners = _load_scope_owners(missing, session=session)
+        known.update((scope, owners.get(scope)) for scope in missing)
+        # unknown scopes are not shared, they may be added later
+        _SHARED_SCOPE_OWNERS.set_multi(owners)
+    return {scope: known[scope] for scope in scopes}
 
 
-def perm_get_auth_token_gss(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def _owns_scopes(issuer: "InternalAccount", scopes: "Iterable[InternalScope]", *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if a user can request a token with user_pass for an account.
+    Checks if the issuer owns every one of the scopes.
 
     :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
+    :param scopes: The scopes to check.
     :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
+    :returns: True if the issuer owns all the scopes, otherwise False
     """
-    if exist_identity_account(identity=kwargs['gsscred'], type_=IdentityType.GSS, account=kwargs['account'], session=session):
-        return True
-    return False
+    return all(owner == issuer for owner in _scope_owners(scopes, session=session).values())
 
 
-def perm_get_auth_token_x509(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+@read_session
+def _load_rse_countries(*, session: "Session") -> dict[str, str]:
     """
-    Checks if a user can request a token with user_pass for an account.
+    Loads the country attribute of all RSEs with a single query.
 
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
     :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
+    :returns: A dictionary of RSE id to country, for the RSEs that have one
     """
-    if exist_identity_account(identity=kwargs['dn'], type_=IdentityType.X509, account=kwargs['account'], session=session):
-        return True
-    return False
+    stmt = select(
+        models.RSEAttrAssociation.rse_id,
+        models.RSEAttrAssociation.value
+    ).where(
+        models.RSEAttrAssociation.key == RseAttr.COUNTRY
+    )
+    return {rse_id: country for rse_id, country in session.execute(stmt)}
 
 
-def perm_get_auth_token_saml(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def _rse_countries(*, session: "Optional[Session]" = None) -> dict[str, str]:
     """
-    Checks if a user can request a token with user_pass for an account.
+    Returns the index of RSE id to country, reloading it once it expired.
 
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
     :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
+    :returns: A dictionary of RSE id to country, for the RSEs that have one
     """
-    if exist_identity_account(identity=kwargs['saml_nameid'], type_=IdentityType.SAML, account=kwargs['account'], session=session):
-        return True
-    return False
+    countries = _RSE_COUNTRY_CACHE.get(None)
+    if countries is None:
+        countries = _load_rse_countries(session=session)
+        _RSE_COUNTRY_CACHE.set(None, countries)
+    return countries
 
 
-def perm_add_account_identity(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def _expression_countries(rse_expression: str, vo: str, *, session: "Optional[Session]" = None) -> set["Optional[str]"]:
     """
-    Checks if an account can add an identity to an account.
+    Returns the countries of the RSEs an expression resolves to.
 
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
+    The RSE ids of an expression are memoized, so repeated checks against the
+    same expression only look them up in the country index.
+
+    :param rse_expression: The RSE expression to resolve.
+    :param vo: The VO the expression is resolved in.
     :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
+    :returns: The set of countries, None for RSEs without a country
     """
-
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
+    rse_ids = _RSE_EXPRESSION_CACHE.get((vo, rse_expression))
+    if rse_ids is None:
+        rse_ids = frozenset(rse['id'] for rse in parse_expression(rse_expression, filter_={'vo': vo}, session=session))
+        _RSE_EXPRESSION_CACHE.set((vo, rse_expression), rse_ids)
+    countries = _rse_countries(session=session)
+    return {countries.get(rse_id) for rse_id in rse_ids}
 
 
-def perm_del_account_identity(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def _identity_exists(identity: str, type_: IdentityType, account: "InternalAccount", *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can delete an identity to an account.
+    Checks if an identity is associated with an account, sharing the known
+    associations between the server processes. Missing associations are only
+    cached per process, for IDENTITY_NEGATIVE_CACHE_TTL seconds.
 
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
+    :param identity: The identity key name.
+    :param type_: The type of the identity.
+    :param account: The account identifier.
     :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
+    :returns: True if the association exists, otherwise False
     """
-
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
+    key = (identity, type_.name, account.internal)
+    exists = _SHARED_IDENTITIES.get(key)
+    hit = exists is not None
+    if not hit:
+        exists = exist_identity_account(identity=identity, type_=type_, account=account, session=session)
+        if exists:
+            _SHARED_IDENTITIES.set(key, True)
+        else:
+            _IDENTITY_CACHE.set(key, False, ttl=IDENTITY_NEGATIVE_CACHE_TTL)
+    _count_identity_lookup(type_, hit)
+    return exists
 
 
-def perm_del_identity(issuer: "InternalAccount", kwargs, *, session: "Optional[Session]" = None) -> bool:
+def _count_identity_lookup(type_: IdentityType, hit: bool) -> None:
     """
-    Checks if an account can delete an identity.
+    Counts the cache hits and misses of the token endpoint of an identity
+    type, and exports the hit ratio of the process.
 
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
-    :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
+    :param type_: The type of the identity.
+    :param hit: Whether the association was cached.
     """
-
-    return _is_root(issuer) or issuer.external in kwargs.get('accounts')
+    endpoint = type_.name.lower()
+    METRICS.counter('auth.{endpoint}.{result}').labels(endpoint=endpoint, result='hit' if hit else 'miss').inc()
+    with _IDENTITY_LOOKUPS_LOCK:
+        _IDENTITY_LOOKUPS[endpoint, hit] += 1
+        hits, misses = _IDENTITY_LOOKUPS[endpoint, True], _IDENTITY_LOOKUPS[endpoint, False]
+    METRICS.gauge('auth.{endpoint}.hit_ratio').labels(endpoint=endpoint).set(hits / (hits + misses))
 
 
-def perm_add_did(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def _invalidate_identities(key: "Optional[tuple[str, str, str]]" = None, *, session: "Optional[Session]" = None) -> None:
     """
-    Checks if an account can add an data identifier to a scope.
+    Drops a cached identity association, or all of them, before it changes,
+    and again once the session commits.
 
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
-    :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
+    :param key: The (identity, type name, internal account) of the association, None for all.
+    :param session: The DB session making the change
     """
-    # Check the accounts of the issued rules
-    if not _is_root(issuer) and not has_account_attribute(account=issuer, key='admin', session=session):
-        for rule in kwargs.get('rules', []):
-            if rule['account'] != issuer:
-                return False
+    def drop(*_) -> None:
+        if key is None:
+            _IDENTITY_CACHE.clear()
+        else:
+            _IDENTITY_CACHE.evict(key)
 
-    return _is_root(issuer)\
-        or has_account_attribute(account=issuer, key='admin', session=session)\
-        or rucio.core.scope.is_scope_owner(scope=kwargs['scope'], account=issuer, session=session)\
-        or kwargs['scope'].external == 'mock'
+    drop()
+    if session is not None:
+        event.listen(session, 'after_commit', drop, once=True)
 
 
-def perm_add_dids(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def _invalidate_rses(*, session: "Optional[Session]" = None) -> None:
     """
-    Checks if an account can bulk add data identifiers.
+    Drops the cached RSE countries and expressions before an RSE or one of its
+    attributes changes, and again once the session commits.
 
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
-    :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
+    :param session: The DB session making the change
     """
-    # Check the accounts of the issued rules
-    if not _is_root(issuer) and not has_account_attribute(account=issuer, key='admin', session=session):
-        for did in kwargs['dids']:
-            for rule in did.get('rules', []):
-                if rule['account'] != issuer:
-                    return False
+    def clear(*_) -> None:
+        _RSE_COUNTRY_CACHE.clear()
+        _RSE_EXPRESSION_CACHE.clear()
 
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
+    clear()
+    if session is not None:
+        event.listen(session, 'after_commit', clear, once=True)
 
 
-def perm_attach_dids(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
-    """
-    Checks if an account can append an data identifier to the other data identifier.
-
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
-    :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
-    """
-    return _is_root(issuer)\
-        or has_account_attribute(account=issuer, key='admin', session=session)\
-        or rucio.core.scope.is_scope_owner(scope=kwargs['scope'], account=issuer, session=session)\
-        or kwargs['scope'].external == 'mock'
+# Change events published through hermes, so every server process evicts the matching entries
+_ACCOUNT_ATTRIBUTE_CHANGE = 'ACCOUNT_ATTRIBUTE_CHANGE'
+_SCOPE_CHANGE = 'SCOPE_CHANGE'
+_IDENTITY_CHANGE = 'IDENTITY_CHANGE'
 
 
-def perm_attach_dids_to_dids(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def _publishing(session: "Optional[Session]") -> bool:
     """
-    Checks if an account can append an data identifier to the other data identifier.
-
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
-    :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
+    Whether change events are published, which needs brokers to listen on and
+    the session making the change.
     """
-    if _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session):
-        return True
-    else:
-        attachments = kwargs['attachments']
-        scopes = [did['scope'] for did in attachments]
-        scopes = list(set(scopes))
-        for scope in scopes:
-            if not rucio.core.scope.is_scope_owner(scope, issuer, session=session):
-                return False
-        return True
+    return bool(INVALIDATION_BROKERS) and session is not None
 
 
-def perm_create_did_sample(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def _publish(event_type: str, payload: dict[str, Any], *, session: "Session") -> None:
     """
-    Checks if an account can create a sample of a data identifier collection.
+    Queues a change event for hermes in the session making the change, so it
+    is only sent if the change commits.
 
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
-    :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
+    :param event_type: The type of the event.
+    :param payload: The entries that change.
+    :param session: The DB session making the change
     """
-    return _is_root(issuer)\
-        or has_account_attribute(account=issuer, key='admin', session=session)\
-        or rucio.core.scope.is_scope_owner(scope=kwargs['scope'], account=issuer, session=session)\
-        or kwargs['scope'].external == 'mock'
+    add_message(event_type, dict(payload, emitted_at=time()), session=session)
 
 
-def perm_del_rule(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
-    """
-    Checks if an issuer can delete a replication rule.
+def _evict_account_attributes(payload: dict[str, Any]) -> None:
+    _ATTRIBUTE_CACHE.evict((payload['vo'], payload['account']))
+    _DECISION_CACHE.clear()
 
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
-    :param session: The DB session to use
-    :returns: True if account is allowed to call the API call, otherwise False
-    """
-    if _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session):
-        return True
-    return False
 
+def _evict_scope_owner(payload: dict[str, Any]) -> None:
+    _SCOPE_OWNER_CACHE.evict(InternalScope(payload['scope'], vo=payload['vo']))
 
-def perm_update_rule(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
-    """
-    Checks if an issuer can update a replication rule.
 
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
-    :param session: The DB session to use
-    :returns: True if account is allowed to call the API call, otherwise False
+def _evict_identities(payload: dict[str, Any]) -> None:
     """
-    if _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session):
-        return True
-    return False
-
-
-def perm_approve_rule(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+    Evicts an identity association, or all of them for removals, whose
+    events do not name the identity.
     """
-    Checks if an issuer can approve a replication rule.
+    local = _SHARED_IDENTITIES.local
+    if local is None:
+        return
+    if payload.get('identity') is None:
+        local.clear()
+    else:
+        local.evict((payload['identity'], payload['type'], InternalAccount(payload['account'], vo=payload['vo']).internal))
 
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
-    :param session: The DB session to use
-    :returns: True if account is allowed to call the API call, otherwise False
-    """
-    if _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session):
-        return True
-    return False
 
+# Hermes sends the event types in lower case
+_INVALIDATION_HANDLERS = {
+    _ACCOUNT_ATTRIBUTE_CHANGE.lower(): _evict_account_attributes,
+    _SCOPE_CHANGE.lower(): _evict_scope_owner,
+    _IDENTITY_CHANGE.lower(): _evict_identities,
+}
+# Brokers with selectors (ActiveMQ, Artemis) only deliver these events, RabbitMQ ignores it and delivers all
+_INVALIDATION_SELECTOR = 'event_type IN ({})'.format(', '.join(f"'{event_type}'" for event_type in sorted(_INVALIDATION_HANDLERS)))
 
-def perm_reduce_rule(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
-    """
-    Checks if an issuer can reduce a replication rule.
 
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
-    :param session: The DB session to use
-    :returns: True if account is allowed to call the API call, otherwise False
+class _InvalidationListener(stomp.ConnectionListener):
     """
-    if _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session):
-        return True
-    return False
+    Evicts the entries named by the change events received from the broker,
+    measuring the lag since the change was made.
+    """
+    def on_message(self, frame: "Frame") -> None:
+        event_type = frame.headers.get('event_type')
+        handler = _INVALIDATION_HANDLERS.get(event_type)
+        if handler is None:
+            return
+        try:
+            payload = json.loads(frame.body)['payload']
+            handler(payload)
+        except (ValueError, KeyError, TypeError):
+            METRICS.counter('invalidation.{event}.invalid').labels(event=event_type).inc()
+            return
+        METRICS.counter('invalidation.{event}.received').labels(event=event_type).inc()
+        if 'emitted_at' in payload:
+            METRICS.timer('invalidation.{event}.lag').labels(event=event_type).observe(max(0.0, time() - payload['emitted_at']))
 
 
-def perm_move_rule(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+class _InvalidationSubscriber:
     """
-    Checks if an issuer can move a replication rule.
+    Keeps a connection to every broker subscribed to the change events, from a
+    daemon thread started by the first permission check of the process.
 
-    :param issuer:   Account identifier which issues the command.
-    :param kwargs:   List of arguments for the action.
-    :param session: The DB session to use
-    :returns:        True if account is allowed to call the API call, otherwise False
+    Every server process holds its own subscription, selecting the event types
+    of _INVALIDATION_HANDLERS on the brokers that support selectors.
     """
-    if _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session):
-        return True
-    return False
+    def __init__(self) -> None:
+        self._thread: "Optional[Thread]" = None
+        self._lock = Lock()
 
+    def start(self) -> None:
+        if self._thread is not None or not INVALIDATION_BROKERS:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='fermilab-policy-invalidations', daemon=True)
+                self._thread.start()
 
-def perm_update_subscription(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
-    """
-    Checks if an account can update a subscription.
+    def _run(self) -> None:
+        conns = [stomp.Connection12(host_and_ports=[(broker, INVALIDATION_PORT)], vhost=INVALIDATION_VHOST, reconnect_attempts_max=1)
+                 for broker in INVALIDATION_BROKERS]
+        while True:
+            for conn in conns:
+                if not conn.is_connected():
+                    self._connect(conn)
+            sleep(INVALIDATION_RECONNECT_INTERVAL)
 
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
-    :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
-    """
-    if _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session):
-        return True
+    @staticmethod
+    def _connect(conn: stomp.Connection12) -> None:
+        try:
+            conn.set_listener('fermilab-policy', _InvalidationListener())
+            conn.connect(INVALIDATION_USERNAME, INVALIDATION_PASSWORD, wait=True)
+            conn.subscribe(destination=INVALIDATION_DESTINATION, id='fermilab-policy', ack='auto',
+                           headers={'selector': _INVALIDATION_SELECTOR})
+        except Exception:
+            METRICS.counter('invalidation.connect_errors').inc()
+            return
+        METRICS.counter('invalidation.connects').inc()
+        # events may have been missed while disconnected
+        for cache in (_ATTRIBUTE_CACHE, _DECISION_CACHE, _SCOPE_OWNER_CACHE, _SHARED_IDENTITIES.local):
+            if cache is not None:
+                cache.clear()
 
-    return False
 
+_INVALIDATION_SUBSCRIBER = _InvalidationSubscriber()
 
-def perm_detach_dids(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+
+def perm_root_or_admin(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can detach an data identifier from the other data identifier.
+    Checks if an account is root or an admin, the rule shared by most actions.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    return perm_attach_dids(issuer, kwargs, session=session)
+    return _is_root(issuer) or _is_admin(issuer, session=session)
 
 
-def perm_set_metadata_bulk(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+# Default permission for actions without a rule of their own
+perm_default = perm_root_or_admin
+
+
+def perm_root(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can set a metadata on a data identifier.
+    Checks if an account is root, for actions reserved to root.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session) or rucio.core.scope.is_scope_owner(scope=kwargs['scope'], account=issuer, session=session)
+    return _is_root(issuer)
 
 
-def perm_set_metadata(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def perm_allow(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can set a metadata on a data identifier.
+    Allows every account, for actions open to everyone.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
+    :returns: True
     """
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session) or rucio.core.scope.is_scope_owner(scope=kwargs['scope'], account=issuer, session=session)
+    return True
 
 
-def perm_set_status(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def perm_deny(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can set status on an data identifier.
+    Denies every account, for actions disabled on this instance.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
+    :returns: False
     """
-    if kwargs.get('open', False):
-        if not _is_root(issuer) and not has_account_attribute(account=issuer, key='admin', session=session):
-            return False
-
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session) or rucio.core.scope.is_scope_owner(scope=kwargs['scope'], account=issuer, session=session)
+    return False
 
 
-def perm_add_protocol(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def perm_modify_rse(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can add a protocol to an RSE.
+    Checks if an account can add, update or delete a RSE or one of its attributes.
+
+    Allowed changes drop the cached RSE countries and expressions.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
+    if _is_root(issuer) or _is_admin(issuer, session=session):
+        _invalidate_rses(session=session)
+        return True
+    return False
 
 
-def perm_del_protocol(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def perm_add_scope(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can delete protocols from an RSE.
+    Checks if an account can add a scope.
+
+    Allowed additions publish a scope change event.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
+    if _is_root(issuer) or _is_admin(issuer, session=session):
+        if _publishing(session):
+            scope = kwargs['scope']
+            _publish(_SCOPE_CHANGE, {'scope': scope.external, 'account': kwargs['account'].external, 'vo': scope.vo}, session=session)
+        return True
+    return False
 
 
-def perm_update_protocol(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def perm_add_rule(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can update protocols of an RSE.
+    Checks if an account can add a replication rule.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
+    if kwargs['account'] == issuer and not kwargs['locked']:
+        return True
+    if _is_root(issuer) or _is_admin(issuer, session=session):
+        return True
+    return False
 
 
-def perm_add_qos_policy(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def perm_get_auth_token_user_pass(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can add QoS policies to an RSE.
+    Checks if a user can request a token with user_pass for an account.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
+    if _identity_exists(kwargs['username'], IdentityType.USERPASS, kwargs['account'], session=session):
+        return True
+    return False
 
 
-def perm_delete_qos_policy(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def perm_get_auth_token_gss(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can delete QoS policies from an RSE.
+    Checks if a user can request a token with user_pass for an account.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
+    if _identity_exists(kwargs['gsscred'], IdentityType.GSS, kwargs['account'], session=session):
+        return True
+    return False
 
 
-def perm_declare_bad_file_replicas(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def perm_get_auth_token_x509(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can declare bad file replicas.
+    Checks if a user can request a token with user_pass for an account.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    return _is_root(issuer)
+    if _identity_exists(kwargs['dn'], IdentityType.X509, kwargs['account'], session=session):
+        return True
+    return False
 
 
-def perm_declare_suspicious_file_replicas(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def perm_get_auth_token_saml(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can declare suspicious file replicas.
+    Checks if a user can request a token with user_pass for an account.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    return True
+    if _identity_exists(kwargs['saml_nameid'], IdentityType.SAML, kwargs['account'], session=session):
+        return True
+    return False
 
 
-def perm_add_replicas(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def perm_add_account_identity(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can add replicas.
+    Checks if an account can add an identity to an account.
+
+    Allowed additions drop the association from the identity cache, where it
+    may be cached as missing, and publish an identity change event.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    return str(kwargs.get('rse', '')).endswith('SCRATCHDISK')\
-        or str(kwargs.get('rse', '')).endswith('USERDISK')\
-        or str(kwargs.get('rse', '')).endswith('MOCK')\
-        or str(kwargs.get('rse', '')).endswith('LOCALGROUPDISK')\
-        or _is_root(issuer)\
-        or has_account_attribute(account=issuer, key='admin', session=session)
+    if _is_root(issuer) or _is_admin(issuer, session=session):
+        account = kwargs['account']
+        _invalidate_identities((kwargs['identity'], kwargs['type'].upper(), account.internal), session=session)
+        if _publishing(session):
+            _publish(_IDENTITY_CHANGE, {'identity': kwargs['identity'], 'type': kwargs['type'].upper(),
+                                        'account': account.external, 'vo': account.vo}, session=session)
+        return True
+    return False
 
 
-def perm_skip_availability_check(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def perm_del_account_identity(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can skip the availabity check to add/delete file replicas.
+    Checks if an account can remove an identity from an account.
+
+    Allowed removals invalidate the cached and shared identity associations and publish
+    an identity change event.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
+    if _is_root(issuer) or _is_admin(issuer, session=session):
+        _invalidate_identities(session=session)
+        _SHARED_IDENTITIES.invalidate(session=session)
+        if _publishing(session):
+            _publish(_IDENTITY_CHANGE, {'account': kwargs['account'].external, 'vo': kwargs['account'].vo}, session=session)
+        return True
+    return False
 
 
-def perm_delete_replicas(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def perm_del_identity(issuer: "InternalAccount", kwargs, *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can delete replicas.
+    Checks if an account can delete an identity.
+
+    Allowed deletions invalidate the cached and shared identity associations and publish
+    an identity change event.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
+    if _is_root(issuer) or issuer.external in kwargs.get('accounts'):
+        _invalidate_identities(session=session)
+        _SHARED_IDENTITIES.invalidate(session=session)
+        if _publishing(session):
+            _publish(_IDENTITY_CHANGE, {'vo': issuer.vo}, session=session)
+        return True
     return False
 
 
-def perm_update_replicas_states(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def perm_add_did(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can delete replicas.
+    Checks if an account can add an data identifier to a scope.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
+    # Check the accounts of the issued rules
+    if not _is_root(issuer) and not _is_admin(issuer, session=session):
+        for rule in kwargs.get('rules', []):
+            if rule['account'] != issuer:
+                return False
+
+    return _is_root(issuer)\
+        or _is_admin(issuer, session=session)\
+        or _owns_scopes(issuer, [kwargs['scope']], session=session)\
+        or kwargs['scope'].external == 'mock'
 
 
-def perm_queue_requests(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def perm_add_dids(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can submit transfer or deletion requests on destination RSEs for data identifiers.
+    Checks if an account can bulk add data identifiers.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    return _is_root(issuer)
+    # Check the accounts of the issued rules
+    if not _is_root(issuer) and not _is_admin(issuer, session=session):
+        for did in kwargs['dids']:
+            for rule in did.get('rules', []):
+                if rule['account'] != issuer:
+                    return False
+
+    return _is_root(issuer) or _is_admin(issuer, session=session)
 
 
-def perm_list_requests(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def perm_attach_dids(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can list requests.
+    Checks if an account can append an data identifier to the other data identifier.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
+    return _is_root(issuer)\
+        or _is_admin(issuer, session=session)\
+        or _owns_scopes(issuer, [kwargs['scope']], session=session)\
+        or kwargs['scope'].external == 'mock'
 
 
-def perm_list_requests_history(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def perm_attach_dids_to_dids(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can list historical requests.
+    Checks if an account can append an data identifier to the other data identifier.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
+    if _is_root(issuer) or _is_admin(issuer, session=session):
+        return True
+    else:
+        return _owns_scopes(issuer, {did['scope'] for did in kwargs['attachments']}, session=session)
 
 
-def perm_get_request_by_did(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def perm_create_did_sample(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can get a request by DID.
+    Checks if an account can create a sample of a data identifier collection.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    return True
+    return _is_root(issuer)\
+        or _is_admin(issuer, session=session)\
+        or _owns_scopes(issuer, [kwargs['scope']], session=session)\
+        or kwargs['scope'].external == 'mock'
 
 
-def perm_get_request_history_by_did(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def perm_detach_dids(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can get a historical request by DID.
+    Checks if an account can detach an data identifier from the other data identifier.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
+    return perm_attach_dids(issuer, kwargs, session=session)
 
 
-def perm_cancel_request(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def perm_set_metadata_bulk(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can cancel a request.
+    Checks if an account can set a metadata on a data identifier.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    return _is_root(issuer)
+    return _is_root(issuer) or _is_admin(issuer, session=session) or _owns_scopes(issuer, [kwargs['scope']], session=session)
 
 
-def perm_get_next(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def perm_set_metadata(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can retrieve the next request matching the request type and state.
+    Checks if an account can set a metadata on a data identifier.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    return _is_root(issuer)
+    return _is_root(issuer) or _is_admin(issuer, session=session) or _owns_scopes(issuer, [kwargs['scope']], session=session)
 
 
-def perm_set_rse_usage(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+def perm_set_status(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can set RSE usage information.
+    Checks if an account can set status on an data identifier.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
-    :returns: True if account is allowed to call the API call, otherwise False
+    :returns: True if account is allowed, otherwise False
     """
-    return _is_root(issuer)
+    if kwargs.get('open', False):
+        if not _is_root(issuer) and not _is_admin(issuer, session=session):
+            return False
 
+    return _is_root(issuer) or _is_admin(issuer, session=session) or _owns_scopes(issuer, [kwargs['scope']], session=session)
 
-def perm_set_rse_limits(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
+
+def perm_add_replicas(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
-    Checks if an account can set RSE limits.
+    Checks if an account can add replicas.
 
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
-    :returns: True if account is allowed to call the API call, otherwise False
+    :returns: True if account is allowed, otherwise False
     """
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
+    return str(kwargs.get('rse', '')).endswith('SCRATCHDISK')\
+        or str(kwargs.get('rse', '')).endswith('USERDISK')\
+        or str(kwargs.get('rse', '')).endswith('MOCK')\
+        or str(kwargs.get('rse', '')).endswith('LOCALGROUPDISK')\
+        or _is_root(issuer)\
+        or _is_admin(issuer, session=session)
 
 
 def perm_set_local_account_limit(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
@@ -861,14 +1258,11 @@ def perm_set_local_account_limit(issuer: "InternalAccount", kwargs: dict[str, An
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    if _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session):
+    if _is_root(issuer) or _is_admin(issuer, session=session):
         return True
     # Check if user is a country admin
-    admin_in_country = []
-    for kv in list_account_attributes(account=issuer, session=session):
-        if kv['key'].startswith('country-') and kv['value'] == 'admin':
-            admin_in_country.append(kv['key'].partition('-')[2])
-    if admin_in_country and list_rse_attributes(rse_id=kwargs['rse_id'], session=session).get(RseAttr.COUNTRY) in admin_in_country:
+    admin_in_country = _account_attributes(issuer, session=session).admin_in_country
+    if admin_in_country and _rse_countries(session=session).get(kwargs['rse_id']) in admin_in_country:
         return True
     return False
 
@@ -882,15 +1276,11 @@ def perm_set_global_account_limit(issuer: "InternalAccount", kwargs: dict[str, A
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    if _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session):
+    if _is_root(issuer) or _is_admin(issuer, session=session):
         return True
     # Check if user is a country admin
-    admin_in_country = set()
-    for kv in list_account_attributes(account=issuer, session=session):
-        if kv['key'].startswith('country-') and kv['value'] == 'admin':
-            admin_in_country.add(kv['key'].partition('-')[2])
-    resolved_rse_countries = {list_rse_attributes(rse_id=rse['rse_id'], session=session).get(RseAttr.COUNTRY)
-                              for rse in parse_expression(kwargs['rse_expression'], filter_={'vo': issuer.vo}, session=session)}
+    admin_in_country = _account_attributes(issuer, session=session).admin_in_country
+    resolved_rse_countries = _expression_countries(kwargs['rse_expression'], issuer.vo, session=session)
     if resolved_rse_countries.issubset(admin_in_country):
         return True
     return False
@@ -905,14 +1295,11 @@ def perm_delete_local_account_limit(issuer: "InternalAccount", kwargs: dict[str,
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    if _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session):
+    if _is_root(issuer) or _is_admin(issuer, session=session):
         return True
     # Check if user is a country admin
-    admin_in_country = []
-    for kv in list_account_attributes(account=issuer, session=session):
-        if kv['key'].startswith('country-') and kv['value'] == 'admin':
-            admin_in_country.append(kv['key'].partition('-')[2])
-    if admin_in_country and list_rse_attributes(rse_id=kwargs['rse_id'], session=session).get(RseAttr.COUNTRY) in admin_in_country:
+    admin_in_country = _account_attributes(issuer, session=session).admin_in_country
+    if admin_in_country and _rse_countries(session=session).get(kwargs['rse_id']) in admin_in_country:
         return True
     return False
 
@@ -926,33 +1313,17 @@ def perm_delete_global_account_limit(issuer: "InternalAccount", kwargs: dict[str
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    if _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session):
+    if _is_root(issuer) or _is_admin(issuer, session=session):
         return True
     # Check if user is a country admin
-    admin_in_country = set()
-    for kv in list_account_attributes(account=issuer, session=session):
-        if kv['key'].startswith('country-') and kv['value'] == 'admin':
-            admin_in_country.add(kv['key'].partition('-')[2])
+    admin_in_country = _account_attributes(issuer, session=session).admin_in_country
     if admin_in_country:
-        resolved_rse_countries = {list_rse_attributes(rse_id=rse['rse_id'], session=session).get(RseAttr.COUNTRY)
-                                  for rse in parse_expression(kwargs['rse_expression'], filter_={'vo': issuer.vo}, session=session)}
+        resolved_rse_countries = _expression_countries(kwargs['rse_expression'], issuer.vo, session=session)
         if resolved_rse_countries.issubset(admin_in_country):
             return True
     return False
 
 
-def perm_config(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
-    """
-    Checks if an account can read/write the configuration.
-
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
-    :param session: The DB session to use
-    :returns: True if account is allowed to call the API call, otherwise False
-    """
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
-
-
 def perm_get_local_account_usage(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
     Checks if an account can get the account usage of an account.
@@ -962,12 +1333,11 @@ def perm_get_local_account_usage(issuer: "InternalAccount", kwargs: dict[str, An
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    if _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session) or kwargs.get('account') == issuer:
+    if _is_root(issuer) or _is_admin(issuer, session=session) or kwargs.get('account') == issuer:
         return True
     # Check if user is a country admin
-    for kv in list_account_attributes(account=issuer, session=session):
-        if kv['key'].startswith('country-') and kv['value'] == 'admin':
-            return True
+    if _account_attributes(issuer, session=session).admin_in_country:
+        return True
     return False
 
 
@@ -980,13 +1350,12 @@ def perm_get_global_account_usage(issuer: "InternalAccount", kwargs: dict[str, A
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    if _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session) or kwargs.get('account') == issuer:
+    if _is_root(issuer) or _is_admin(issuer, session=session) or kwargs.get('account') == issuer:
         return True
 
     # Check if user is a country admin for all involved countries
-    for kv in list_account_attributes(account=issuer, session=session):
-        if kv['key'].startswith('country-') and kv['value'] == 'admin':
-            return True
+    if _account_attributes(issuer, session=session).admin_in_country:
+        return True
     return False
 
 
@@ -994,12 +1363,17 @@ def perm_add_account_attribute(issuer: "InternalAccount", kwargs: dict[str, Any]
     """
     Checks if an account can add attributes to accounts.
 
+    Allowed changes invalidate the cached attributes of the account.
+
     :param issuer: Account identifier which issues the command.
     :param kwargs: List of arguments for the action.
     :param session: The DB session to use
     :returns: True if account is allowed to call the API call, otherwise False
     """
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
+    if _is_root(issuer) or _is_admin(issuer, session=session):
+        _invalidate_account_attributes(kwargs['account'], session=session)
+        return True
+    return False
 
 
 def perm_del_account_attribute(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
@@ -1014,30 +1388,6 @@ def perm_del_account_attribute(issuer: "InternalAccount", kwargs: dict[str, Any]
     return perm_add_account_attribute(issuer, kwargs, session=session)
 
 
-def perm_list_heartbeats(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
-    """
-    Checks if an account can list heartbeats.
-
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
-    :param session: The DB session to use
-    :returns: True if account is allowed to call the API call, otherwise False
-    """
-    return _is_root(issuer)
-
-
-def perm_resurrect(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
-    """
-    Checks if an account can resurrect DIDS.
-
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
-    :param session: The DB session to use
-    :returns: True if account is allowed to call the API call, otherwise False
-    """
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
-
-
 def perm_update_lifetime_exceptions(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
     """
     Checks if an account can approve/reject Lifetime Model exceptions.
@@ -1050,41 +1400,7 @@ def perm_update_lifetime_exceptions(issuer: "InternalAccount", kwargs: dict[str,
         exceptions = next(list_exceptions(exception_id=kwargs['exception_id'], states=False, session=session))
         if exceptions['scope'].vo != kwargs['vo']:
             return False
-    return _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session)
-
-
-def perm_get_auth_token_ssh(issuer: "InternalAccount", kwargs: dict, *, session: "Optional[Session]" = None) -> bool:
-    """
-    Checks if an account can request an ssh token.
-
-    :param issuer: Account identifier which issues the command.
-    :param session: The DB session to use
-    :returns: True if account is allowed to call the API call, otherwise False
-    """
-    return True
-
-
-def perm_get_signed_url(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
-    """
-    Checks if an account can request a signed URL.
-
-    :param issuer: Account identifier which issues the command.
-    :param session: The DB session to use
-    :returns: True if account is allowed to call the API call, otherwise False
-    """
-    return _is_root(issuer)
-
-
-def perm_add_bad_pfns(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
-    """
-    Checks if an account can declare bad PFNs.
-
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
-    :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
-    """
-    return _is_root(issuer)
+    return _is_root(issuer) or _is_admin(issuer, session=session)
 
 
 def perm_remove_did_from_followed(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
@@ -1097,7 +1413,7 @@ def perm_remove_did_from_followed(issuer: "InternalAccount", kwargs: dict[str, A
     :returns: True if account is allowed, otherwise False
     """
     return _is_root(issuer)\
-        or has_account_attribute(account=issuer, key='admin', session=session)\
+        or _is_admin(issuer, session=session)\
         or kwargs['account'] == issuer\
         or kwargs['scope'].external == 'mock'
 
@@ -1111,20 +1427,115 @@ def perm_remove_dids_from_followed(issuer: "InternalAccount", kwargs: dict[str,
     :param session: The DB session to use
     :returns: True if account is allowed, otherwise False
     """
-    if _is_root(issuer) or has_account_attribute(account=issuer, key='admin', session=session):
+    if _is_root(issuer) or _is_admin(issuer, session=session):
         return True
     if not kwargs['account'] == issuer:
         return False
     return True
 
 
-def perm_export(issuer: "InternalAccount", kwargs: dict[str, Any], *, session: "Optional[Session]" = None) -> bool:
-    """
-    Checks if an account can export the RSE info.
-
-    :param issuer: Account identifier which issues the command.
-    :param kwargs: List of arguments for the action.
-    :param session: The DB session to use
-    :returns: True if account is allowed, otherwise False
-    """
-    return _is_root(issuer)
+# Rule of every action, actions missing here fall back to perm_default
+_PERMISSIONS = {
+    'add_account': perm_root,
+    'del_account': perm_root,
+    'update_account': perm_root_or_admin,
+    'add_rule': perm_add_rule,
+    'add_subscription': perm_root_or_admin,
+    'add_scope': perm_add_scope,
+    'add_rse': perm_modify_rse,
+    'update_rse': perm_modify_rse,
+    'add_protocol': perm_root_or_admin,
+    'del_protocol': perm_root_or_admin,
+    'update_protocol': perm_root_or_admin,
+    'add_qos_policy': perm_root_or_admin,
+    'delete_qos_policy': perm_root_or_admin,
+    'declare_bad_file_replicas': perm_root,
+    'declare_suspicious_file_replicas': perm_allow,
+    'add_replicas': perm_add_replicas,
+    'delete_replicas': perm_deny,
+    'skip_availability_check': perm_root_or_admin,
+    'update_replicas_states': perm_root_or_admin,
+    'add_rse_attribute': perm_modify_rse,
+    'del_rse_attribute': perm_modify_rse,
+    'del_rse': perm_modify_rse,
+    'del_rule': perm_root_or_admin,
+    'update_rule': perm_root_or_admin,
+    'approve_rule': perm_root_or_admin,
+    'update_subscription': perm_root_or_admin,
+    'reduce_rule': perm_root_or_admin,
+    'move_rule': perm_root_or_admin,
+    'get_auth_token_user_pass': perm_get_auth_token_user_pass,
+    'get_auth_token_gss': perm_get_auth_token_gss,
+    'get_auth_token_x509': perm_get_auth_token_x509,
+    'get_auth_token_saml': perm_get_auth_token_saml,
+    'add_account_identity': perm_add_account_identity,
+    'add_did': perm_add_did,
+    'add_dids': perm_add_dids,
+    'attach_dids': perm_attach_dids,
+    'detach_dids': perm_detach_dids,
+    'attach_dids_to_dids': perm_attach_dids_to_dids,
+    'create_did_sample': perm_create_did_sample,
+    'set_metadata': perm_set_metadata,
+    'set_metadata_bulk': perm_set_metadata_bulk,
+    'set_status': perm_set_status,
+    'queue_requests': perm_root,
+    'set_rse_usage': perm_root,
+    'set_rse_limits': perm_root_or_admin,
+    'list_requests': perm_root_or_admin,
+    'list_requests_history': perm_root_or_admin,
+    'get_request_by_did': perm_allow,
+    'get_request_history_by_did': perm_root_or_admin,
+    'cancel_request': perm_root,
+    'get_next': perm_root,
+    'set_local_account_limit': perm_set_local_account_limit,
+    'set_global_account_limit': perm_set_global_account_limit,
+    'delete_local_account_limit': perm_delete_local_account_limit,
+    'delete_global_account_limit': perm_delete_global_account_limit,
+    'config_sections': perm_root_or_admin,
+    'config_add_section': perm_root_or_admin,
+    'config_has_section': perm_root_or_admin,
+    'config_options': perm_root_or_admin,
+    'config_has_option': perm_root_or_admin,
+    'config_get': perm_root_or_admin,
+    'config_items': perm_root_or_admin,
+    'config_set': perm_root_or_admin,
+    'config_remove_section': perm_root_or_admin,
+    'config_remove_option': perm_root_or_admin,
+    'get_local_account_usage': perm_get_local_account_usage,
+    'get_global_account_usage': perm_get_global_account_usage,
+    'add_attribute': perm_add_account_attribute,
+    'del_attribute': perm_del_account_attribute,
+    'list_heartbeats': perm_root,
+    'resurrect': perm_root_or_admin,
+    'update_lifetime_exceptions': perm_update_lifetime_exceptions,
+    'get_auth_token_ssh': perm_allow,
+    'get_signed_url': perm_root,
+    'add_bad_pfns': perm_root,
+    'del_account_identity': perm_del_account_identity,
+    'del_identity': perm_del_identity,
+    'remove_did_from_followed': perm_remove_did_from_followed,
+    'remove_dids_from_followed': perm_remove_dids_from_followed,
+    'export': perm_root,
+}
+
+# Scopes whose owners decide an action for issuers that are neither root nor admin
+_SCOPE_ARGUMENTS: dict[str, "Callable[[dict[str, Any]], Iterable[Optional[InternalScope]]]"] = {
+    'add_did': lambda kwargs: [kwargs.get('scope')],
+    'attach_dids': lambda kwargs: [kwargs.get('scope')],
+    'detach_dids': lambda kwargs: [kwargs.get('scope')],
+    'attach_dids_to_dids': lambda kwargs: [did.get('scope') for did in kwargs.get('attachments', [])],
+    'create_did_sample': lambda kwargs: [kwargs.get('scope')],
+    'set_metadata': lambda kwargs: [kwargs.get('scope')],
+    'set_metadata_bulk': lambda kwargs: [kwargs.get('scope')],
+    'set_status': lambda kwargs: [kwargs.get('scope')],
+}
+
+# Actions whose decisions may be cached, with the kwargs the decisions depend on
+# besides the issuer. The rules of the request actions only look at the issuer.
+_CACHEABLE_ACTIONS: dict[str, tuple[str, ...]] = {
+    'list_requests': (),
+    'list_requests_history': (),
+    'get_request_by_did': (),
+    'get_request_history_by_did': (),
+    'get_next': (),
+}
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the policy package's has_permission dispatch
+
+Reports has_permission calls per second for every action registered in the
+package's _PERMISSIONS, plus an unregistered one taking the default rule,
+each called by root, an admin and a plain user. Every action is timed on its
+own, and all of them as a mix, except the actions that invalidate the cached
+lookups of the other rules. The attributes, scope owners, identities and RSE
+countries the rules look up are seeded into the package's caches before each
+timing, so no database round trips are timed for revisions that have those
+caches. Revisions without them time their queries. Pass --baseline to compare
+with another revision of permission.py, e.g.:
+
+    mkdir /tmp/before
+    git show <rev>:overlays/int/rucio/etc/policy-package/permission.py > /tmp/before/permission.py
+    python3 util/bench_has_permission.py --baseline /tmp/before
+
+With --batch, the calls of every issuer go through a single has_permissions
+call instead, or one has_permission call each for revisions without it.
+
+Needs rucio importable with a rucio.cfg, e.g. inside the rucio-server image.
+"""
+
+import argparse
+import importlib.util
+import os
+import timeit
+
+from rucio.common.types import InternalAccount, InternalScope
+
+ROOT = InternalAccount('root')
+ADMIN = InternalAccount('bench_admin')
+USER = InternalAccount('bench_user')
+# Account whose attributes are changed by add_attribute and del_attribute, so the issuers stay cached
+TARGET = InternalAccount('bench_target')
+SCOPE = InternalScope('user.bench_user')
+RSE_EXPRESSION = 'BENCH_SCRATCHDISK'
+IDENTITIES = {'dn': ('/DC=org/DC=cilogon/C=US/O=Fermilab/OU=People/CN=Bench', 'X509'),
+              'username': ('bench', 'USERPASS'),
+              'gsscred': ('bench@FNAL.GOV', 'GSS'),
+              'saml_nameid': ('bench', 'SAML')}
+UNKNOWN_ACTION = 'unknown_action'
+
+# Actions whose allowed calls drop the cached RSEs or identities other rules read, timed on their own only
+INVALIDATING = {'add_rse', 'update_rse', 'del_rse', 'add_rse_attribute', 'del_rse_attribute',
+                'add_account_identity', 'del_account_identity', 'del_identity'}
+# Kwargs of actions whose rules would otherwise invalidate the cached issuers
+OVERRIDES = {
+    'add_attribute': {'account': TARGET},
+    'del_attribute': {'account': TARGET},
+}
+
+
+def load_permission_module(package: str, name: str):
+    """Import permission.py of a policy package directory"""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(package, 'permission.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def seed(module):
+    """Store what the rules look up for the synthetic accounts in the caches the package has"""
+    for account, admin in ((ADMIN, True), (USER, False), (TARGET, False)):
+        attributes = module._AccountAttributes(admin=admin, admin_in_country=frozenset())
+        module._ATTRIBUTE_CACHE.set((account.vo, account.external), attributes)
+    if hasattr(module, '_SCOPE_OWNER_CACHE'):
+        module._SCOPE_OWNER_CACHE.set(SCOPE, USER)
+    if hasattr(module, '_IDENTITY_CACHE'):
+        for account in (ROOT, ADMIN, USER):
+            for identity, type_ in IDENTITIES.values():
+                module._IDENTITY_CACHE.set((identity, type_, account.internal), True)
+    if hasattr(module, '_RSE_COUNTRY_CACHE'):
+        module._RSE_COUNTRY_CACHE.set(None, {})
+    if hasattr(module, '_RSE_EXPRESSION_CACHE'):
+        module._RSE_EXPRESSION_CACHE.set((USER.vo, RSE_EXPRESSION), frozenset())
+
+
+def make_kwargs(issuer: InternalAccount, action: str) -> dict:
+    """Build kwargs carrying every argument the rules read, as the gateway passes them"""
+    kwargs = {'account': issuer, 'accounts': [issuer.external], 'locked': False, 'open': False, 'vo': None,
+              'scope': SCOPE, 'rse': RSE_EXPRESSION, 'rse_id': 'bench_rse_id', 'rse_expression': RSE_EXPRESSION,
+              'dids': [{'scope': SCOPE, 'name': 'bench'}], 'rules': [{'account': issuer}],
+              'attachments': [{'scope': SCOPE, 'name': 'bench'}], 'exception_id': None,
+              'identity': IDENTITIES['dn'][0], 'type': 'x509',
+              **{name: identity for name, (identity, _) in IDENTITIES.items()}}
+    kwargs.update(OVERRIDES.get(action, {}))
+    return kwargs
+
+
+def make_calls(actions: list[str]) -> dict[str, list[tuple]]:
+    """Build the (issuer, action, kwargs) calls of every action"""
+    return {action: [(issuer, action, make_kwargs(issuer, action)) for issuer in (ROOT, ADMIN, USER)]
+            for action in actions}
+
+
+def calls_per_second(module, calls: list[tuple], number: int, repeat: int, batch: bool = False) -> float:
+    if batch and hasattr(module, 'has_permissions'):
+        has_permissions = module.has_permissions
+        batches = {}
+        for issuer, action, kwargs in calls:
+            batches.setdefault(issuer, []).append((action, kwargs))
+
+        def run():
+            for issuer, checks in batches.items():
+                has_permissions(issuer, checks)
+    else:
+        has_permission = module.has_permission
+
+        def run():
+            for issuer, action, kwargs in calls:
+                has_permission(issuer, action, kwargs)
+
+    seed(module)
+    run()  # warm the caches outside the timed runs
+    best = min(timeit.repeat(run, number=number, repeat=repeat))
+    return len(calls) * number / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark has_permission of a policy package')
+    parser.add_argument('--package', default=os.path.join(os.path.dirname(__file__), '..', 'overlays', 'int', 'rucio', 'etc', 'policy-package'),
+                        help='policy package directory containing permission.py')
+    parser.add_argument('--baseline', help='policy package directory of the revision to compare with')
+    parser.add_argument('--number', type=int, default=2000, help='passes over the calls per timing')
+    parser.add_argument('--batch', action='store_true', help='check the calls of every issuer with one has_permissions call')
+    parser.add_argument('--repeat', type=int, default=5, help='timing repetitions, the best one is reported')
+    args = parser.parse_args()
+
+    packages = {'after': args.package}
+    if args.baseline:
+        packages = {'before': args.baseline, **packages}
+    modules = {label: load_permission_module(package, f'policy_permission_{label}') for label, package in packages.items()}
+
+    actions = sorted(modules['after']._PERMISSIONS) + [UNKNOWN_ACTION]
+    calls = make_calls(actions)
+    mix = [call for action, action_calls in calls.items() if action not in INVALIDATING for call in action_calls]
+
+    results = {label: {} for label in modules}
+    for label, module in modules.items():
+        for action, action_calls in calls.items():
+            results[label][action] = calls_per_second(module, action_calls, args.number, args.repeat, args.batch)
+        results[label]['(mix)'] = calls_per_second(module, mix, max(1, args.number // len(actions)), args.repeat, args.batch)
+
+    labels = list(modules)
+    header = f"{'action':<36}" + ''.join(f' {label + " (calls/s)":>18}' for label in labels)
+    print(header + (f" {'speedup':>8}" if 'before' in results else ''))
+    for action in results['after']:
+        line = f'{action:<36}' + ''.join(f' {results[label][action]:>18,.0f}' for label in labels)
+        if 'before' in results:
+            line += f" {results['after'][action] / results['before'][action]:>7.2f}x"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
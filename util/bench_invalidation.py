@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the policy package's broker-driven cache invalidation
+
+Serves the in-process STOMP stand-in of util/stomp_standin.py, points the
+package's invalidation listener at it and seeds the attribute cache of
+synthetic accounts. Change events are then sent the way hermes sends them,
+and each one is timed until its cache entry is evicted. Reports the lag
+percentiles and the events evicted per second.
+
+Needs rucio importable with a rucio.cfg, e.g. inside the rucio-server image:
+
+    python3 util/bench_invalidation.py --events 1000 --latency 1
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+import stomp
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from bench_has_permission import load_permission_module  # noqa: E402
+from stomp_standin import StompStandIn  # noqa: E402
+
+DESTINATION = '/topic/rucio.events.bench'
+
+
+def send_event(conn: stomp.Connection12, event_type: str, payload: dict):
+    """Sends an event with the body and headers of hermes"""
+    body = json.dumps({'event_type': event_type.lower(), 'payload': payload, 'created_at': time.strftime('%Y-%m-%d %H:%M:%S')})
+    conn.send(body=body, destination=DESTINATION, headers={'persistent': 'true', 'event_type': event_type.lower()})
+
+
+def wait(condition, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.0001)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the invalidation lag of a policy package')
+    parser.add_argument('--package', default=os.path.join(os.path.dirname(__file__), '..', 'overlays', 'int', 'rucio', 'etc', 'policy-package'),
+                        help='policy package directory containing permission.py')
+    parser.add_argument('--events', type=int, default=1000, help='change events to send')
+    parser.add_argument('--latency', type=float, default=0.0, help='milliseconds the broker adds to every delivery')
+    parser.add_argument('--timeout', type=float, default=5.0, help='seconds to wait for an eviction')
+    args = parser.parse_args()
+
+    broker = StompStandIn(latency=args.latency / 1000)
+    threading.Thread(target=broker.serve_forever, daemon=True).start()
+    host, port = broker.host_and_port
+
+    module = load_permission_module(args.package, 'policy_permission_bench')
+    module.INVALIDATION_BROKERS = [host]
+    module.INVALIDATION_PORT = port
+    module.INVALIDATION_DESTINATION = DESTINATION
+    module._INVALIDATION_SUBSCRIBER.start()
+    if not wait(lambda: broker.subscribers(DESTINATION) > 0, args.timeout):
+        sys.exit('The invalidation listener did not subscribe')
+
+    accounts = [f'bench{i:06d}' for i in range(args.events)]
+    attributes = module._AccountAttributes(admin=False, admin_in_country=frozenset())
+    for account in accounts:
+        module._ATTRIBUTE_CACHE.set(('def', account), attributes)
+
+    conn = stomp.Connection12(host_and_ports=[(host, port)])
+    conn.connect(wait=True)
+    lags, missed = [], 0
+    start = time.perf_counter()
+    for account in accounts:
+        sent = time.perf_counter()
+        send_event(conn, module._ACCOUNT_ATTRIBUTE_CHANGE, {'account': account, 'vo': 'def', 'emitted_at': time.time()})
+        if wait(lambda: module._ATTRIBUTE_CACHE.get(('def', account)) is None, args.timeout):
+            lags.append(time.perf_counter() - sent)
+        else:
+            missed += 1
+    wall = time.perf_counter() - start
+    conn.disconnect()
+    broker.shutdown()
+    broker.server_close()
+
+    if not lags:
+        sys.exit(f'None of the {args.events} events was evicted')
+    lags.sort()
+
+    def percentile(p: float) -> float:
+        return lags[min(len(lags) - 1, int(len(lags) * p))] * 1000
+
+    print(f'{"events":>8} {"missed":>8} {"p50 (ms)":>10} {"p95 (ms)":>10} {"p99 (ms)":>10} {"max (ms)":>10} {"mean (ms)":>10} {"events/s":>10}')
+    print(f'{args.events:>8} {missed:>8} {percentile(0.5):>10.2f} {percentile(0.95):>10.2f} {percentile(0.99):>10.2f} '
+          f'{lags[-1] * 1000:>10.2f} {statistics.mean(lags) * 1000:>10.2f} {len(lags) / wall:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
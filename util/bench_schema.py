@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the policy package's validate_schema
+
+Compares the per-call latency of a plain jsonschema.validate call, which is
+what validate_schema used to do, with the policy package's validate_schema
+for the 'dids', 'attachments', 'rule' and 'cache_add_replicas' schemas.
+
+Needs jsonschema and rucio importable, e.g. inside the rucio-server image:
+
+    python3 util/bench_schema.py --package overlays/int/rucio/etc/policy-package
+"""
+
+import argparse
+import importlib.util
+import os
+import timeit
+
+from jsonschema import validate
+
+
+def load_schema_module(package: str):
+    """Import schema.py of a policy package directory"""
+    spec = importlib.util.spec_from_file_location('policy_schema', os.path.join(package, 'schema.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_did(i: int) -> dict:
+    return {'scope': 'user.bench',
+            'name': f'file_{i:06d}.root',
+            'bytes': 1024 + i,
+            'adler32': f'{i:08x}',
+            'md5': f'{i:032x}'}
+
+
+def make_payloads(items: int) -> dict:
+    """Build representative payloads for the benchmarked schemas"""
+    per_attachment = max(1, items // 10)
+    return {
+        'dids': [make_did(i) for i in range(items)],
+        'attachments': [{'scope': 'user.bench',
+                         'name': f'dataset_{a:03d}',
+                         'rse': 'FNAL_DCACHE',
+                         'dids': [make_did(a * per_attachment + i) for i in range(per_attachment)]}
+                        for a in range(10)],
+        'rule': {'dids': [{'scope': 'user.bench', 'name': 'dataset_000'}],
+                 'account': 'bench',
+                 'copies': 1,
+                 'rse_expression': 'FNAL_DCACHE',
+                 'grouping': 'DATASET',
+                 'lifetime': 86400,
+                 'locked': False,
+                 'activity': 'User Subscriptions',
+                 'notify': 'N',
+                 'comment': 'benchmark'},
+        'cache_add_replicas': {'files': [{key: value for key, value in make_did(i).items() if key != 'md5'} for i in range(items)],
+                               'rse': 'FNAL_CACHE',
+                               'lifetime': 86400,
+                               'operation': 'add_replicas'},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark validate_schema of a policy package')
+    parser.add_argument('--package', default=os.path.join(os.path.dirname(__file__), '..', 'overlays', 'int', 'rucio', 'etc', 'policy-package'),
+                        help='policy package directory containing schema.py')
+    parser.add_argument('--items', type=int, default=1000, help='number of DIDs in the bulk payloads')
+    parser.add_argument('--repeat', type=int, default=5, help='timing repetitions, the best one is reported')
+    args = parser.parse_args()
+
+    schema = load_schema_module(args.package)
+    payloads = make_payloads(args.items)
+
+    print(f"{'schema':<20} {'before (ms)':>12} {'after (ms)':>12} {'speedup':>8}")
+    for name, obj in payloads.items():
+        number = 20 if name == 'rule' else 3
+        before = min(timeit.repeat(lambda: validate(obj, schema.SCHEMAS[name]), number=number, repeat=args.repeat)) / number
+        schema.validate_schema(name, obj)  # compile the validator outside the timed runs
+        after = min(timeit.repeat(lambda: schema.validate_schema(name, obj), number=number, repeat=args.repeat)) / number
+        print(f'{name:<20} {before * 1000:>12.3f} {after * 1000:>12.3f} {before / after:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Scaling benchmark of the FERRY user fetch and account reconciliation in sync_ferry_users
+
+Builds a synthetic affiliation and getAllUsersCertificateDNs payload and
+times resolving every member's DNs and user info, comparing the previous
+per-user linear filter over all DNs with the username index. It then times
+the dry-run reconciliation of the users against a synthetic Rucio account
+listing. FERRY and Rucio are replaced by in-memory stand-ins, so only the
+client-side work is timed.
+
+Needs the rucio clients importable, e.g. inside the rucio-client image:
+
+    python3 util/bench_sync_ferry_users.py --users 1000 5000 20000 --accounts 50000
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'images', 'client', 'scripts'))
+
+import sync_ferry_users  # noqa: E402
+from sync_ferry_users import User, fetch_users, index_dns, reconcile  # noqa: E402
+
+
+class StandInFerry:
+    """
+    Answers getUserInfo from memory
+    """
+    def __init__(self, users: int):
+        self.info = {f'user{i:06d}': {'status': i % 50 != 0, 'banned': False, 'uuid': f'{i:032x}'} for i in range(users)}
+
+    def getUserInfo(self, username: str) -> dict:
+        return self.info[username]
+
+
+def make_dns(users: int) -> list[dict]:
+    """Build a getAllUsersCertificateDNs payload, most users have one or two certificates"""
+    return [{'username': f'user{i:06d}',
+             'certificates': [{'unitname': 'bench', 'dn': f'/DC=org/DC=cilogon/C=US/O=Fermilab/OU=People/CN=User {i} {c}'}
+                              for c in range(1 + i % 2)]}
+            for i in range(users) if i % 20 != 0]
+
+
+def legacy_fetch_users(ferry, usernames: list[str], all_dns: list[dict], issuer: str) -> list[User]:
+    """The sequential loop with a linear DN filter per user, as it was before the index"""
+    users_to_add = []
+    for username in usernames:
+        user = ferry.getUserInfo(username)
+        if not user['status'] or user['banned']:
+            continue
+        user_dns = list(filter(lambda x: x['username'] == username, all_dns))
+        dn = user_dns[0]['certificates'] if user_dns else []
+        users_to_add.append(User(name=username, identities=dn, uuid=user['uuid'], issuer=issuer))
+    return users_to_add
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the FERRY user fetch of sync_ferry_users')
+    parser.add_argument('--users', type=int, nargs='+', default=[1000, 5000, 20000], help='affiliation sizes to time')
+    parser.add_argument('--workers', type=int, default=1, help='fetch_users worker threads')
+    parser.add_argument('--no-legacy', dest='legacy', action='store_false', help='skip the quadratic legacy loop')
+    parser.add_argument('--accounts', type=int, default=50000, help='Rucio USER accounts to reconcile')
+    args = parser.parse_args()
+
+    # the missing DN errors of the synthetic users are expected
+    sync_ferry_users.logger.setLevel(logging.CRITICAL)
+
+    print(f"{'users':>8} {'before (s)':>12} {'after (s)':>12} {'speedup':>8}")
+    for size in args.users:
+        ferry = StandInFerry(size)
+        usernames = list(ferry.info)
+        all_dns = make_dns(size)
+
+        start = time.perf_counter()
+        users = fetch_users(ferry, usernames, index_dns(all_dns), 'https://cilogon.org/fermilab', args.workers)
+        after = [user for user in users if user.active]
+        after_time = time.perf_counter() - start
+
+        if args.legacy:
+            start = time.perf_counter()
+            before = legacy_fetch_users(ferry, usernames, all_dns, 'https://cilogon.org/fermilab')
+            before_time = time.perf_counter() - start
+            assert before == after
+            print(f'{size:>8} {before_time:>12.3f} {after_time:>12.3f} {before_time / after_time:>7.1f}x')
+        else:
+            print(f"{size:>8} {'-':>12} {after_time:>12.3f} {'-':>8}")
+
+    # reconcile an affiliation against a larger account listing, half of it not affiliated
+    ferry = StandInFerry(args.accounts // 2)
+    usernames = list(ferry.info)
+    users = fetch_users(ferry, usernames, {}, 'https://cilogon.org/fermilab', args.workers)
+    accounts = ({'account': f'user{i:06d}', 'type': 'USER'} for i in range(args.accounts))
+    start = time.perf_counter()
+    diff = reconcile(accounts, set(usernames), users)
+    print(f'reconciled {args.accounts} accounts in {time.perf_counter() - start:.3f}s: '
+          f'{len(diff.add)} to add, {len(diff.disable)} to disable, {len(diff.keep)} to keep')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of sync_ferry_users against the local FERRY stand-in
+
+For each affiliation size, serves synthetic fixtures (or recorded ones with
+--fixtures) from util/ferry_standin.py and runs the whole sync, dry-run
+unless --commit, in a child process pointed at it with FERRY_URL. Rucio is
+replaced by the in-memory stand-in of util/rucio_standin.py, seeded with a
+fraction of the users as existing accounts and with stale accounts that are
+no longer affiliated. Reports the wall time of the sync, the FERRY requests it made
+per endpoint, the injected errors, the Rucio calls and the peak RSS of the
+child.
+
+Needs the rucio clients importable, e.g. inside the rucio-client image:
+
+    python3 util/bench_sync_standin.py --users 1000 10000 50000 --latency 2 --error-rate 0.001
+
+    # commit and disable with 5ms per Rucio call, half of the users already exist
+    python3 util/bench_sync_standin.py --commit --delete_accounts --existing 0.5 --stale 100 --rucio-latency 5
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from ferry_standin import FerryFixtures, FerryStandIn  # noqa: E402
+from rucio_standin import RucioStandIn  # noqa: E402
+
+
+def seed_rucio(fixtures: FerryFixtures, existing: float, stale: int, latency: float) -> RucioStandIn:
+    """Creates the Rucio stand-in with the first users of the fixtures and stale accounts"""
+    rucio = RucioStandIn(latency=latency)
+    dns = {record['username']: [(c['dn'], 'X509') for c in record['certificates']] for record in fixtures.dns}
+    usernames = list(fixtures.users)[:int(len(fixtures.users) * existing)]
+    rucio.add_accounts(usernames, identities=dns)
+    rucio.add_accounts(f'stale{i:06d}' for i in range(stale))
+    return rucio
+
+
+def run_sync(args):
+    """Runs the sync in this process and prints its wall time, Rucio calls and peak RSS as JSON"""
+    import logging
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'images', 'client', 'scripts'))
+    import sync_ferry_users
+
+    fixtures = FerryFixtures.load(args.fixtures) if args.fixtures else FerryFixtures.synthetic(args.users[0])
+    rucio = seed_rucio(fixtures, args.existing, args.stale, args.rucio_latency / 1000)
+    logging.disable(logging.CRITICAL)
+    sync_ferry_users.RucioClient = rucio.client
+    with tempfile.TemporaryDirectory() as state:
+        start = time.perf_counter()
+        sync_ferry_users.sync_ferry_users(commit=args.commit, delete_accounts=args.delete_accounts, vo=fixtures.unitname,
+                                          workers=args.workers, max_rate=args.max_rate, email_cache='',
+                                          commit_workers=args.commit_workers, rucio_max_rate=args.rucio_max_rate,
+                                          journal_file=os.path.join(state, 'journal.jsonl'))
+        wall = time.perf_counter() - start
+    print(json.dumps({'wall': wall, 'rucio': dict(rucio.calls), 'maxrss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+
+
+def bench(server: FerryStandIn, args, cert: str) -> dict:
+    """Runs the sync in a child process against the stand-in"""
+    env = dict(os.environ, FERRY_URL=server.url, FERRY_VO=server.fixtures.unitname,
+               X509_USER_CERT=cert, X509_USER_KEY=cert)
+    command = [sys.executable, __file__, '--child', '--users', str(len(server.fixtures.users)),
+               '--workers', str(args.workers), '--max_rate', str(args.max_rate),
+               '--commit_workers', str(args.commit_workers), '--rucio_max_rate', str(args.rucio_max_rate),
+               '--existing', str(args.existing), '--stale', str(args.stale), '--rucio-latency', str(args.rucio_latency)]
+    if args.fixtures:
+        command += ['--fixtures', args.fixtures]
+    if args.commit:
+        command.append('--commit')
+    if args.delete_accounts:
+        command.append('--delete_accounts')
+    server.reset_counts()
+    result = subprocess.run(command, env=env, check=True, capture_output=True, text=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark sync_ferry_users against the FERRY stand-in')
+    parser.add_argument('--users', type=int, nargs='+', default=[1000, 10000, 50000], help='synthetic affiliation sizes')
+    parser.add_argument('--fixtures', help='recorded fixtures to replay instead of synthetic users')
+    parser.add_argument('--latency', type=float, default=0.0, help='milliseconds added to every FERRY response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random milliseconds added on top of the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of FERRY requests answered with a 503')
+    parser.add_argument('--workers', type=int, default=8, help='concurrent FERRY user info requests of the sync')
+    parser.add_argument('--max_rate', type=float, default=0, help='FERRY requests per second of the sync, 0 for no limit')
+    parser.add_argument('--commit', action='store_true', help='commit the users to the Rucio stand-in')
+    parser.add_argument('--delete_accounts', action='store_true', help='disable the stale accounts')
+    parser.add_argument('--commit_workers', type=int, default=4, help='accounts committed concurrently')
+    parser.add_argument('--rucio_max_rate', type=float, default=0, help='Rucio requests per second while committing, 0 for no limit')
+    parser.add_argument('--rucio-latency', type=float, default=0.0, help='milliseconds taken by every Rucio call')
+    parser.add_argument('--existing', type=float, default=0.0, help='fraction of the users that already have an account')
+    parser.add_argument('--stale', type=int, default=0, help='accounts in Rucio that are no longer affiliated')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_sync(args)
+        return
+
+    if args.fixtures:
+        datasets = [FerryFixtures.load(args.fixtures)]
+    else:
+        datasets = (FerryFixtures.synthetic(size) for size in args.users)
+
+    # the FERRY client needs a client certificate file even over plain HTTP
+    with tempfile.NamedTemporaryFile() as cert:
+        print(f"{'users':>8} {'wall (s)':>10} {'requests':>10} {'errors':>8} {'rucio':>8} {'peak RSS (MB)':>14}  per endpoint")
+        for fixtures in datasets:
+            server = FerryStandIn(fixtures, latency=args.latency / 1000, jitter=args.jitter / 1000, error_rate=args.error_rate)
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                result = bench(server, args, cert.name)
+            finally:
+                server.shutdown()
+                server.server_close()
+            endpoints = ', '.join(f'{endpoint} {count}' for endpoint, count in sorted(server.requests.items()))
+            print(f'{len(fixtures.users):>8} {result["wall"]:>10.2f} {sum(server.requests.values()):>10} '
+                  f'{sum(server.errors.values()):>8} {sum(result["rucio"].values()):>8} {result["maxrss"] / 1024:>14.1f}  {endpoints}')
+            print(f"{'':>8} rucio: {', '.join(f'{method} {count}' for method, count in sorted(result['rucio'].items()))}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Randomized parity check of the policy package's fast schema validation
+
+For every schema in FAST_SCHEMAS (dids, r_dids, attachments,
+cache_add_replicas and cache_delete_replicas), generates valid payloads and
+random mutations of them: replaced, removed and unexpected keys, junk items,
+empty and oversized arrays. Each payload goes through validate_schema and
+through a plain jsonschema.validate against the same SCHEMAS entry, and the
+check fails unless both accept, or both reject with the same InvalidObject
+message. The compiled fast predicate must never accept a payload jsonschema
+rejects.
+
+Run it after editing SCHEMAS or _compile_check. Needs jsonschema and rucio
+importable, e.g. inside the rucio-server image:
+
+    python3 util/check_schema_parity.py --package overlays/int/rucio/etc/policy-package --payloads 20000
+"""
+
+import argparse
+import copy
+import os
+import random
+import sys
+from collections import Counter
+
+from jsonschema import ValidationError, validate
+
+from rucio.common.exception import InvalidObject
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from bench_schema import load_schema_module, make_did  # noqa: E402
+
+# Values swapped into payloads, covering every type and the edges of the schema patterns and lengths
+JUNK = [None, True, False, 0, 1, -5, 1.0, 1.5, 2 ** 70, float('nan'), '', 'x', 'a b', 'abc\n', 'A' * 26, 'a' * 251,
+        '0000000g', '0000000a', 'ABCDEF12', 'a' * 32, 'f' * 33, [], {}, [1], {'a': 1}, 'DATASET', 'F', 'AVAILABLE',
+        'FNAL_DCACHE', 'fnal_dcache', '-bad', '.x', 'user.x', 'X' * 25, 'add_replicas', 'delete_replicas',
+        {'guid': 'not-a-guid'}, {'guid': '12345678-1234-1234-1234-123456789012'},
+        [{'dids': [], 'copies': 1, 'rse_expression': 'X'}], [{'copies': 1}]]
+KEYS = ['scope', 'name', 'bytes', 'adler32', 'md5', 'type', 'state', 'pfn', 'meta', 'rules', 'rse', 'dids',
+        'lifetime', 'operation', 'files', 'extra']
+
+
+def valid_payload(name: str, rnd: random.Random):
+    """Builds a payload the schema accepts"""
+    did = make_did(rnd.randrange(1000))
+    if name in ('dids', 'r_dids'):
+        return [dict(did, type='FILE', state='A', pfn='root://x', meta={'guid': '12345678123412341234123456789012'})
+                for _ in range(rnd.randrange(1, 5))]
+    if name == 'attachments':
+        return [{'scope': 'user.x', 'name': 'ds', 'rse': rnd.choice([None, 'FNAL_DCACHE']), 'dids': [did]}
+                for _ in range(rnd.randrange(1, 4))]
+    if name == 'cache_add_replicas':
+        return {'files': [{key: did[key] for key in ('scope', 'name', 'bytes', 'adler32')}],
+                'rse': 'FNAL_CACHE', 'lifetime': 10, 'operation': 'add_replicas'}
+    if name == 'cache_delete_replicas':
+        return {'files': [{'scope': 'user.x', 'name': 'f'}], 'rse': 'FNAL_CACHE', 'operation': 'delete_replicas'}
+    raise ValueError(f'No payload generator for schema {name}')
+
+
+def containers(obj) -> list:
+    """Returns the dictionaries and lists nested in a payload, including itself"""
+    found = []
+    if isinstance(obj, dict):
+        found.append(obj)
+        for value in obj.values():
+            found += containers(value)
+    elif isinstance(obj, list):
+        found.append(obj)
+        for value in obj:
+            found += containers(value)
+    return found
+
+
+def mutate(obj, rnd: random.Random):
+    """Applies up to two random edits to a payload, in place"""
+    for _ in range(rnd.randrange(0, 3)):
+        target = rnd.choice(containers(obj))
+        op = rnd.random()
+        if isinstance(target, dict):
+            if op < 0.6 and target:
+                target[rnd.choice(list(target))] = copy.deepcopy(rnd.choice(JUNK))
+            elif op < 0.8 and target:
+                del target[rnd.choice(list(target))]
+            else:
+                target[rnd.choice(KEYS)] = copy.deepcopy(rnd.choice(JUNK))
+        else:
+            if op < 0.4 and target:
+                target[rnd.randrange(len(target))] = copy.deepcopy(rnd.choice(JUNK))
+            elif op < 0.6:
+                target.clear()
+            elif op < 0.7 and target:
+                target.extend(copy.deepcopy(target[0]) for _ in range(1001))
+            else:
+                target.append(copy.deepcopy(rnd.choice(JUNK)))
+    return obj
+
+
+def reference_error(name: str, obj, schema) -> str:
+    """Returns the InvalidObject message of a plain jsonschema.validate, None if it accepts"""
+    try:
+        if obj:
+            validate(obj, schema.SCHEMAS[name])
+    except ValidationError as error:
+        return str(InvalidObject(f'Problem validating {name}: {error}'))
+    return None
+
+
+def fast_error(name: str, obj, schema) -> str:
+    """Returns the InvalidObject message of validate_schema, None if it accepts"""
+    try:
+        schema.validate_schema(name, obj)
+    except InvalidObject as error:
+        return str(error)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the fast schema validation against jsonschema')
+    parser.add_argument('--package', default=os.path.join(os.path.dirname(__file__), '..', 'overlays', 'int', 'rucio', 'etc', 'policy-package'),
+                        help='policy package directory containing schema.py')
+    parser.add_argument('--payloads', type=int, default=20000, help='random payloads to check')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    schema = load_schema_module(args.package)
+    rnd = random.Random(args.seed)
+    counts = Counter()
+    failures = 0
+    for _ in range(args.payloads):
+        name = rnd.choice(schema.FAST_SCHEMAS)
+        obj = mutate(valid_payload(name, rnd), rnd)
+        expected = reference_error(name, obj, schema)
+        got = fast_error(name, obj, schema)
+        if got != expected or (expected is not None and schema._FAST_CHECKS[name](obj)):
+            failures += 1
+            print(f'{name}: jsonschema {expected!r}, validate_schema {got!r}\n  {obj!r:.500}', file=sys.stderr)
+        counts[name, expected is None] += 1
+
+    print(f"{'schema':<24} {'valid':>8} {'invalid':>8}")
+    for name in schema.FAST_SCHEMAS:
+        print(f'{name:<24} {counts[name, True]:>8} {counts[name, False]:>8}')
+    if failures:
+        sys.exit(f'{failures} of {args.payloads} payloads differ from jsonschema.validate')
+    print(f'All {args.payloads} payloads match jsonschema.validate')
+
+
+if __name__ == '__main__':
+    main()
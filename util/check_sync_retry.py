@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Check that delta runs of sync_ferry_users retry the users left incomplete
+
+Serves synthetic fixtures from util/ferry_standin.py and commits them with
+--delta runs to the in-memory Rucio stand-in of util/rucio_standin.py. The
+accounts already exist without an email, so adding their identities needs the
+LDAP email, and the LDAP lookup of one user fails in the first run. That user
+must be left out of the snapshot without identities, and the next delta run,
+with the LDAP lookup working again, must retry that user alone and add its
+identities. Exits with an error otherwise.
+
+Needs the rucio clients importable, e.g. inside the rucio-client image:
+
+    python3 util/check_sync_retry.py --users 50
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'images', 'client', 'scripts'))
+
+import sync_ferry_users  # noqa: E402
+from ferry_standin import FerryFixtures, FerryStandIn  # noqa: E402
+from rucio_standin import RucioStandIn  # noqa: E402
+
+
+def run_delta(fixtures: FerryFixtures, state: str):
+    """Runs a committing delta sync against the stand-ins"""
+    sync_ferry_users.sync_ferry_users(commit=True, vo=fixtures.unitname, max_rate=0, delta=True,
+                                      state_file=os.path.join(state, 'state.json'), email_cache='',
+                                      rucio_max_rate=0, journal_file=os.path.join(state, 'journal.jsonl'))
+    with open(os.path.join(state, 'state.json')) as f:
+        return json.load(f)['users']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that delta syncs retry users whose identities were not added')
+    parser.add_argument('--users', type=int, default=20, help='synthetic affiliation size')
+    args = parser.parse_args()
+
+    fixtures = FerryFixtures.synthetic(args.users)
+    active = [name for name, info in fixtures.users.items() if info['status'] and not info['banned']]
+    with_dns = {record['username'] for record in fixtures.dns}
+    victim = next(name for name in active if name in with_dns)
+    for name in fixtures.users:
+        fixtures.ldap.setdefault(name, {'uid': name, 'mail': f'{name}@fnal.gov'})
+    ldap = fixtures.ldap.pop(victim)
+
+    rucio = RucioStandIn()
+    rucio.add_accounts(active)
+    for name in active:
+        rucio.accounts[name]['email'] = None
+    sync_ferry_users.RucioClient = rucio.client
+
+    failures = []
+
+    def check(condition: bool, message: str):
+        print(f"{'ok' if condition else 'FAILED':<8}{message}")
+        if not condition:
+            failures.append(message)
+
+    server = FerryStandIn(fixtures)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.disable(logging.CRITICAL)
+    # the FERRY client needs a client certificate file even over plain HTTP
+    with tempfile.NamedTemporaryFile() as cert, tempfile.TemporaryDirectory() as state:
+        os.environ.update(FERRY_URL=server.url, FERRY_VO=fixtures.unitname, X509_USER_CERT=cert.name, X509_USER_KEY=cert.name)
+        try:
+            snapshot = run_delta(fixtures, state)
+            check(not rucio.identities[victim], f'first run added no identities of {victim}, whose LDAP lookup failed')
+            check(victim not in snapshot, f'first run left {victim} out of the snapshot')
+            check(all(rucio.identities[name] for name in active if name != victim), 'first run added the identities of the other users')
+
+            fixtures.ldap[victim] = ldap
+            rucio.calls.clear()
+            snapshot = run_delta(fixtures, state)
+            check(rucio.calls['get_account'] == 1, f"second run retried one user, got {rucio.calls['get_account']}")
+            check(bool(rucio.identities[victim]), f'second run added the identities of {victim}')
+            check(victim in snapshot, f'second run recorded {victim} in the snapshot')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    if failures:
+        sys.exit(f'{len(failures)} checks failed')
+
+
+if __name__ == '__main__':
+    main()
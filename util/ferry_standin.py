@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Local FERRY stand-in for benchmarking sync_ferry_users offline
+
+Serves getAffiliationMembers, getUserInfo, getAllUsersCertificateDNs and
+getUserLdapInfo over plain HTTP from fixtures, which are either generated
+synthetically or recorded from a real FERRY. Every response can be delayed
+and a fraction of them replaced by an HTTP error, to exercise the client's
+retries. Requests are counted per endpoint.
+
+    # serve 10k synthetic users with 5ms latency and 1% of 503 errors
+    python3 util/ferry_standin.py serve --users 10000 --latency 5 --error-rate 0.01
+
+    # record fixtures of an affiliation from FERRY, with the FerryClient settings
+    python3 util/ferry_standin.py record --unitname dune --output dune.json
+
+    # replay them
+    python3 util/ferry_standin.py serve --fixtures dune.json
+
+Point the sync at it with FERRY_URL=http://127.0.0.1:<port>.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FerryFixtures:
+    """
+    The FERRY data served by the stand-in
+    """
+    def __init__(self, unitname: str, members: list[dict], users: dict[str, dict], dns: list[dict], ldap: dict[str, dict]):
+        self.unitname = unitname
+        self.members = members
+        self.users = users
+        self.dns = dns
+        self.ldap = ldap
+
+    @classmethod
+    def synthetic(cls, users: int, unitname: str = 'int', seed: int = 0) -> 'FerryFixtures':
+        """
+        Generates an affiliation of users, a few of them inactive, banned,
+        without certificates or without an LDAP entry
+        """
+        rnd = random.Random(seed)
+        members, info, dns, ldap = [], {}, [], {}
+        for i in range(users):
+            username = f'user{i:06d}'
+            uuid = f'{rnd.getrandbits(128):032x}'
+            members.append({'username': username, 'uuid': uuid})
+            info[username] = {'username': username, 'uuid': uuid, 'status': rnd.random() > 0.02, 'banned': rnd.random() < 0.005}
+            if rnd.random() > 0.05:
+                dns.append({'username': username,
+                            'certificates': [{'unitname': unitname, 'dn': f'/DC=org/DC=cilogon/C=US/O=Fermilab/OU=People/CN=User {i}/CN=UID:{username}{c}'}
+                                             for c in range(1 + (rnd.random() < 0.2))]})
+            if rnd.random() > 0.01:
+                ldap[username] = {'uid': username, 'mail': f'{username}@fnal.gov'}
+        return cls(unitname, [{'unitname': unitname, 'users': members}], info, dns, ldap)
+
+    @classmethod
+    def load(cls, path: str) -> 'FerryFixtures':
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data['unitname'], data['members'], data['users'], data['dns'], data['ldap'])
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump({'unitname': self.unitname, 'members': self.members, 'users': self.users,
+                       'dns': self.dns, 'ldap': self.ldap}, f)
+
+
+def envelope(output) -> bytes:
+    if output is None:
+        return json.dumps({'ferry_status': 'failure', 'ferry_error': ['No such user.']}).encode()
+    return json.dumps({'ferry_status': 'success', 'ferry_error': [], 'ferry_output': output}).encode()
+
+
+class FerryStandIn(ThreadingHTTPServer):
+    """
+    HTTP server answering the FERRY endpoints used by sync_ferry_users
+    """
+    daemon_threads = True
+
+    def __init__(self, fixtures: FerryFixtures, address=('127.0.0.1', 0), latency: float = 0.0,
+                 jitter: float = 0.0, error_rate: float = 0.0, error_status: int = 503, seed: int = 0):
+        super().__init__(address, FerryHandler)
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = Counter()
+        self.errors = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # the bulk documents are encoded once
+        self._members = envelope(fixtures.members)
+        self._dns = envelope(fixtures.dns)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def reset_counts(self):
+        with self._lock:
+            self.requests.clear()
+            self.errors.clear()
+
+    def respond(self, endpoint: str, params: dict) -> tuple[int, bytes]:
+        """
+        Returns the status and body of a request, after the injected latency
+        """
+        with self._lock:
+            self.requests[endpoint] += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors[endpoint] += 1
+        if delay:
+            time.sleep(delay)
+        if failed:
+            return self.error_status, b''
+
+        fixtures = self.fixtures
+        username = params.get('username')
+        if endpoint == 'getAffiliationMembers':
+            return 200, self._members if params.get('unitname') == fixtures.unitname else envelope(None)
+        if endpoint == 'getAllUsersCertificateDNs':
+            return 200, self._dns
+        if endpoint == 'getUserInfo':
+            return 200, envelope(fixtures.users.get(username))
+        if endpoint == 'getUserLdapInfo':
+            return 200, envelope(fixtures.ldap.get(username))
+        return 404, b''
+
+
+class FerryHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # the headers and body go out in separate writes on kept-alive connections
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        status, body = self.server.respond(url.path.strip('/'), params)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def record(unitname: str, output: str, limit: int = None):
+    """
+    Records the fixtures of an affiliation from FERRY
+    """
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'images', 'client', 'scripts'))
+    from FerryClient import FerryClient
+
+    with FerryClient() as ferry:
+        members = ferry.getAffiliationMembers(unitname)
+        usernames = [member['username'] for member in members[0]['users']][:limit]
+        dns = ferry.getAllUsersCertificateDNs(unitname)
+        users, ldap = {}, {}
+        for username in usernames:
+            try:
+                users[username] = ferry.getUserInfo(username)
+                ldap[username] = ferry.getUserLdapInfo(username)
+            except Exception as e:
+                print(f'{username}: {e}', file=sys.stderr)
+        if limit is not None:
+            members[0]['users'] = members[0]['users'][:limit]
+            dns = [record for record in dns if record['username'] in users]
+    FerryFixtures(unitname, members, users, dns, ldap).save(output)
+    print(f'Recorded {len(usernames)} users of {unitname} to {output}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local FERRY stand-in')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='serve fixtures over HTTP')
+    serve.add_argument('--fixtures', help='recorded fixtures, synthetic users are generated otherwise')
+    serve.add_argument('--users', type=int, default=1000, help='number of synthetic users')
+    serve.add_argument('--unitname', default='int', help='affiliation of the synthetic users')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8445)
+    serve.add_argument('--latency', type=float, default=0.0, help='milliseconds added to every response')
+    serve.add_argument('--jitter', type=float, default=0.0, help='random milliseconds added on top of the latency')
+    serve.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with an error')
+    serve.add_argument('--error-status', type=int, default=503, help='HTTP status of the injected errors')
+
+    rec = commands.add_parser('record', help='record fixtures from FERRY')
+    rec.add_argument('--unitname', required=True)
+    rec.add_argument('--output', required=True)
+    rec.add_argument('--limit', type=int, help='record only the first users of the affiliation')
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        record(args.unitname, args.output, args.limit)
+        return
+
+    fixtures = FerryFixtures.load(args.fixtures) if args.fixtures else FerryFixtures.synthetic(args.users, args.unitname)
+    server = FerryStandIn(fixtures, (args.host, args.port), latency=args.latency / 1000, jitter=args.jitter / 1000,
+                          error_rate=args.error_rate, error_status=args.error_status)
+    print(f'Serving {len(fixtures.users)} users of {fixtures.unitname} on {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(dict(server.requests))
+
+
+if __name__ == '__main__':
+    main()
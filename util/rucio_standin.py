@@ -0,0 +1,153 @@
+"""
+In-memory stand-in of the Rucio client calls made by sync_ferry_users
+
+Implements get_account, add_account, list_identities, add_identity,
+add_scope, add_account_attribute, list_accounts and delete_account with the
+semantics of a Rucio server: missing accounts raise AccountNotFound, existing
+accounts, identity associations, scopes and attributes raise Duplicate, and
+deleted accounts are still returned by get_account but neither listed nor
+deletable again. Every call sleeps for a tunable latency, so commit and
+delete benchmarks are deterministic.
+
+The state lives in a RucioStandIn shared by all its clients, which stand in
+for the per-thread clients of the sync:
+
+    rucio = RucioStandIn(latency=0.005)
+    rucio.add_accounts(['alice', 'bob'])
+    sync_ferry_users.RucioClient = rucio.client
+"""
+
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from rucio.common.exception import AccountNotFound, Duplicate
+
+
+class RucioStandIn:
+    """
+    Accounts, identities, scopes and attributes of a stand-in Rucio server
+    """
+    def __init__(self, latency: float = 0.0, latencies: dict[str, float] = None):
+        self.latency = latency
+        self.latencies = latencies or {}
+        self.accounts = {}
+        self.identities = {}
+        self.scopes = {}
+        self.attributes = {}
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def client(self) -> 'RucioClientStandIn':
+        return RucioClientStandIn(self)
+
+    def add_accounts(self, accounts, type_: str = 'USER', identities: dict[str, list[tuple[str, str]]] = None):
+        """
+        Seeds accounts and their (identity, type) pairs, without counting calls
+        """
+        identities = identities or {}
+        for account in accounts:
+            self._add_account(account, type_, f'{account}@fnal.gov')
+            for identity, authtype in identities.get(account, ()):
+                self.identities[account][(identity, authtype)] = f'{account}@fnal.gov'
+
+    def call(self, method: str):
+        """
+        Counts a call and waits for its latency
+        """
+        with self._lock:
+            self.calls[method] += 1
+        delay = self.latencies.get(method, self.latency)
+        if delay:
+            time.sleep(delay)
+
+    def account(self, account: str) -> dict:
+        try:
+            return self.accounts[account]
+        except KeyError:
+            raise AccountNotFound(f"Account with ID '{account}' cannot be found")
+
+    def _add_account(self, account: str, type_: str, email: str):
+        if account in self.accounts:
+            raise Duplicate(f"Account ID '{account}' already exists!")
+        now = datetime.utcnow()
+        self.accounts[account] = {'account': account, 'account_type': type_, 'status': 'ACTIVE', 'email': email,
+                                  'created_at': now, 'updated_at': now, 'suspended_at': None, 'deleted_at': None}
+        self.identities[account] = {}
+        self.attributes[account] = {}
+
+
+class RucioClientStandIn:
+    """
+    The Rucio client calls of sync_ferry_users, served by a RucioStandIn
+    """
+    def __init__(self, rucio: RucioStandIn):
+        self.rucio = rucio
+
+    def get_account(self, account: str) -> dict:
+        self.rucio.call('get_account')
+        with self.rucio._lock:
+            return dict(self.rucio.account(account))
+
+    def add_account(self, account: str, type_: str, email: str) -> bool:
+        self.rucio.call('add_account')
+        with self.rucio._lock:
+            self.rucio._add_account(account, type_, email)
+        return True
+
+    def delete_account(self, account: str) -> bool:
+        self.rucio.call('delete_account')
+        with self.rucio._lock:
+            info = self.rucio.accounts.get(account)
+            if info is None or info['status'] != 'ACTIVE':
+                raise AccountNotFound(f"Account with ID '{account}' cannot be found")
+            info.update(status='DELETED', deleted_at=datetime.utcnow())
+        return True
+
+    def list_accounts(self, account_type: str = None, identity: str = None, filters: dict = None):
+        self.rucio.call('list_accounts')
+        with self.rucio._lock:
+            accounts = [{'account': info['account'], 'type': info['account_type'], 'email': info['email']}
+                        for name, info in self.rucio.accounts.items()
+                        if info['status'] == 'ACTIVE'
+                        and (account_type is None or info['account_type'] == account_type)
+                        and (identity is None or any(i == identity for i, _ in self.rucio.identities[name]))]
+        return iter(accounts)
+
+    def list_identities(self, account: str):
+        self.rucio.call('list_identities')
+        with self.rucio._lock:
+            self.rucio.account(account)
+            identities = [{'type': authtype, 'identity': identity, 'email': email}
+                          for (identity, authtype), email in self.rucio.identities[account].items()]
+        return iter(identities)
+
+    def add_identity(self, account: str, identity: str, authtype: str, email: str, default: bool = False, password: str = None) -> bool:
+        self.rucio.call('add_identity')
+        with self.rucio._lock:
+            self.rucio.account(account)
+            identities = self.rucio.identities[account]
+            if (identity, authtype) in identities:
+                raise Duplicate(f"Identity pair '{identity}','{authtype}' already exists!")
+            identities[(identity, authtype)] = email
+        return True
+
+    def add_scope(self, account: str, scope: str) -> bool:
+        self.rucio.call('add_scope')
+        with self.rucio._lock:
+            self.rucio.account(account)
+            if scope in self.rucio.scopes:
+                raise Duplicate(f"Scope '{scope}' already exists!")
+            self.rucio.scopes[scope] = account
+        return True
+
+    def add_account_attribute(self, account: str, key: str, value) -> bool:
+        self.rucio.call('add_account_attribute')
+        with self.rucio._lock:
+            self.rucio.account(account)
+            attributes = self.rucio.attributes[account]
+            if key in attributes:
+                raise Duplicate(f"Account attribute '{key}' already exists for account '{account}'!")
+            attributes[key] = value
+        return True
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+In-process STOMP stand-in for the messenger broker
+
+Speaks enough STOMP 1.2 for hermes and the policy package's invalidation
+listener: CONNECT/STOMP, SUBSCRIBE, UNSUBSCRIBE, SEND, DISCONNECT and
+receipts. Every message sent to a destination is delivered to all of its
+subscriptions, like a RabbitMQ topic, after a tunable latency. Messages are
+counted per destination.
+
+    # serve on the port of fnal-rucio-messenger
+    python3 util/stomp_standin.py --port 61613
+
+    # or from a benchmark
+    broker = StompStandIn()
+    threading.Thread(target=broker.serve_forever, daemon=True).start()
+    conn = stomp.Connection12(host_and_ports=[broker.host_and_port])
+"""
+
+import argparse
+import itertools
+import socketserver
+import threading
+import time
+from collections import Counter
+
+_ESCAPES = {'\\': '\\\\', '\r': '\\r', '\n': '\\n', ':': '\\c'}
+_UNESCAPES = {'\\\\': '\\', '\\r': '\r', '\\n': '\n', '\\c': ':'}
+
+
+def escape(value: str) -> str:
+    return ''.join(_ESCAPES.get(c, c) for c in value)
+
+
+def unescape(value: str) -> str:
+    out, chars = [], iter(value)
+    for c in chars:
+        if c == '\\':
+            c = _UNESCAPES.get(c + next(chars, ''), '')
+        out.append(c)
+    return ''.join(out)
+
+
+def encode_frame(command: str, headers: dict[str, str], body: bytes = b'') -> bytes:
+    lines = [command] + [f'{escape(key)}:{escape(str(value))}' for key, value in headers.items()]
+    return ('\n'.join(lines) + '\n\n').encode() + body + b'\0'
+
+
+class StompStandIn(socketserver.ThreadingTCPServer):
+    """
+    STOMP server delivering every message to the subscriptions of its destination
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency: float = 0.0):
+        super().__init__(address, StompHandler)
+        self.latency = latency
+        self.sent = Counter()
+        self.delivered = Counter()
+        self._subscriptions: dict['StompHandler', dict[str, str]] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def host_and_port(self) -> tuple[str, int]:
+        return self.server_address[:2]
+
+    def subscribers(self, destination: str) -> int:
+        with self._lock:
+            return sum(destination in subscriptions.values() for subscriptions in self._subscriptions.values())
+
+    def subscribe(self, handler: 'StompHandler', id_: str, destination: str):
+        with self._lock:
+            self._subscriptions.setdefault(handler, {})[id_] = destination
+
+    def unsubscribe(self, handler: 'StompHandler', id_: str = None):
+        with self._lock:
+            if id_ is None:
+                self._subscriptions.pop(handler, None)
+            else:
+                self._subscriptions.get(handler, {}).pop(id_, None)
+
+    def publish(self, destination: str, headers: dict[str, str], body: bytes):
+        """
+        Delivers a message to the subscriptions of its destination, after the latency
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        headers = {key: value for key, value in headers.items() if key not in ('receipt', 'content-length', 'destination')}
+        with self._lock:
+            self.sent[destination] += 1
+            message_id = next(self._ids)
+            targets = [(handler, id_) for handler, subscriptions in self._subscriptions.items()
+                       for id_, subscribed in subscriptions.items() if subscribed == destination]
+        for handler, id_ in targets:
+            frame_headers = dict(headers, subscription=id_, destination=destination, **{'message-id': message_id})
+            frame_headers['content-length'] = len(body)
+            if handler.write(encode_frame('MESSAGE', frame_headers, body)):
+                with self._lock:
+                    self.delivered[destination] += 1
+
+
+class StompHandler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self._write_lock = threading.Lock()
+
+    def write(self, data: bytes) -> bool:
+        try:
+            with self._write_lock:
+                self.wfile.write(data)
+                self.wfile.flush()
+            return True
+        except OSError:
+            return False
+
+    def read_frame(self):
+        """
+        Returns the command, headers and body of the next frame, None once the client is gone
+        """
+        line = b'\n'
+        while line in (b'\n', b'\r\n'):  # heart-beats
+            line = self.rfile.readline()
+            if not line:
+                return None
+        command = line.decode().rstrip('\r\n')
+        headers = {}
+        while True:
+            line = self.rfile.readline().decode().rstrip('\r\n')
+            if not line:
+                break
+            key, _, value = line.partition(':')
+            headers.setdefault(unescape(key), unescape(value))
+        if 'content-length' in headers:
+            body = self.rfile.read(int(headers['content-length']))
+            self.rfile.read(1)
+        else:
+            body = bytearray()
+            while (c := self.rfile.read(1)) not in (b'\0', b''):
+                body += c
+            body = bytes(body)
+        return command, headers, body
+
+    def handle(self):
+        server: StompStandIn = self.server
+        try:
+            while (frame := self.read_frame()) is not None:
+                command, headers, body = frame
+                if command in ('CONNECT', 'STOMP'):
+                    self.write(encode_frame('CONNECTED', {'version': '1.2', 'heart-beat': '0,0', 'server': 'stomp-standin'}))
+                elif command == 'SUBSCRIBE':
+                    server.subscribe(self, headers['id'], headers['destination'])
+                elif command == 'UNSUBSCRIBE':
+                    server.unsubscribe(self, headers['id'])
+                elif command == 'SEND':
+                    server.publish(headers['destination'], headers, body)
+                if 'receipt' in headers:
+                    self.write(encode_frame('RECEIPT', {'receipt-id': headers['receipt']}))
+                if command == 'DISCONNECT':
+                    break
+        except (OSError, ValueError):
+            pass
+        finally:
+            server.unsubscribe(self)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='In-process STOMP stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=61613)
+    parser.add_argument('--latency', type=float, default=0.0, help='milliseconds added to every delivery')
+    args = parser.parse_args()
+
+    server = StompStandIn((args.host, args.port), latency=args.latency / 1000)
+    print(f'Serving STOMP on {args.host}:{server.host_and_port[1]}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(dict(server.sent))
+
+
+if __name__ == '__main__':
+    main()